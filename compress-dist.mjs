@@ -0,0 +1,37 @@
+// Genera las versiones precomprimidas (.br y .gz) de los ficheros de dist/ tras `vite build`.
+// Flask las sirve en lugar del original si el navegador las acepta (src/api/static_files.py).
+import { readdir, readFile, stat, writeFile } from "node:fs/promises";
+import { join } from "node:path";
+import { promisify } from "node:util";
+import { brotliCompress, gzip, constants } from "node:zlib";
+
+const DIST = process.argv[2] || "dist";
+const COMPRESSIBLE = /\.(js|mjs|css|html|json|svg|txt|xml|map|ico|wasm)$/;
+// Por debajo de este tamano la cabecera de compresion no compensa
+const MIN_SIZE = 1024;
+
+const brotli = promisify(brotliCompress);
+const gz = promisify(gzip);
+
+async function* walk(dir) {
+  for (const entry of await readdir(dir, { withFileTypes: true })) {
+    const path = join(dir, entry.name);
+    if (entry.isDirectory()) yield* walk(path);
+    else yield path;
+  }
+}
+
+let count = 0;
+for await (const path of walk(DIST)) {
+  if (!COMPRESSIBLE.test(path) || (await stat(path)).size < MIN_SIZE) continue;
+  const content = await readFile(path);
+  const [br, gzipped] = await Promise.all([
+    brotli(content, { params: { [constants.BROTLI_PARAM_QUALITY]: constants.BROTLI_MAX_QUALITY } }),
+    gz(content, { level: constants.Z_BEST_COMPRESSION }),
+  ]);
+  // Solo se guarda la variante si realmente ocupa menos
+  if (br.length < content.length) await writeFile(`${path}.br`, br);
+  if (gzipped.length < content.length) await writeFile(`${path}.gz`, gzipped);
+  count++;
+}
+console.log(`compress-dist: ${count} files precompressed in ${DIST}/`);
@@ -51,6 +51,17 @@ def get_metadata():
     return target_db.metadata
 
 
+# Objects created by hand in migrations that are not part of the models
+# (full text search). Autogenerate must not try to drop them.
+MANUAL_OBJECTS = ('product_fts', 'ix_product_search')
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    if reflected and compare_to is None and name and name.startswith(MANUAL_OBJECTS):
+        return False
+    return True
+
+
 def run_migrations_offline():
     """Run migrations in 'offline' mode.
 
@@ -65,7 +76,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -93,6 +105,7 @@ def run_migrations_online():
     conf_args = current_app.extensions['migrate'].configure_args
     if conf_args.get("process_revision_directives") is None:
         conf_args["process_revision_directives"] = process_revision_directives
+    conf_args.setdefault("include_object", include_object)
 
     connectable = get_engine()
 
@@ -0,0 +1,58 @@
+"""product full text search
+
+Revision ID: 0b7e5f3a9c21
+Revises: f2b8c61d0a57
+Create Date: 2026-10-18 13:21:55.204719
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0b7e5f3a9c21'
+down_revision = 'f2b8c61d0a57'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # La expresion del indice debe coincidir con PG_DOCUMENT en src/api/search.py
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("CREATE INDEX ix_product_search ON product "
+                   "USING gin (to_tsvector('simple', name || ' ' || details))")
+        return
+
+    # SQLite: tabla FTS5 de contenido externo sincronizada con triggers
+    op.execute("CREATE VIRTUAL TABLE product_fts USING fts5("
+               "name, details, content='product', content_rowid='id')")
+    op.execute("INSERT INTO product_fts(rowid, name, details) SELECT id, name, details FROM product")
+    op.execute('''
+        CREATE TRIGGER product_fts_ai AFTER INSERT ON product BEGIN
+            INSERT INTO product_fts(rowid, name, details) VALUES (new.id, new.name, new.details);
+        END
+    ''')
+    op.execute('''
+        CREATE TRIGGER product_fts_ad AFTER DELETE ON product BEGIN
+            INSERT INTO product_fts(product_fts, rowid, name, details)
+            VALUES ('delete', old.id, old.name, old.details);
+        END
+    ''')
+    op.execute('''
+        CREATE TRIGGER product_fts_au AFTER UPDATE OF name, details ON product BEGIN
+            INSERT INTO product_fts(product_fts, rowid, name, details)
+            VALUES ('delete', old.id, old.name, old.details);
+            INSERT INTO product_fts(rowid, name, details) VALUES (new.id, new.name, new.details);
+        END
+    ''')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute("DROP INDEX ix_product_search")
+        return
+
+    op.execute("DROP TRIGGER product_fts_au")
+    op.execute("DROP TRIGGER product_fts_ad")
+    op.execute("DROP TRIGGER product_fts_ai")
+    op.execute("DROP TABLE product_fts")
@@ -0,0 +1,44 @@
+"""stock reservations
+
+Revision ID: 5e2d8a7c4b19
+Revises: 0b7e5f3a9c21
+Create Date: 2026-10-18 17:02:41.381920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5e2d8a7c4b19'
+down_revision = '0b7e5f3a9c21'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('reserved', sa.Integer(), server_default='0', nullable=False))
+
+    op.create_table('reservation',
+    sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+    sa.Column('order_id', sa.Integer(), nullable=False),
+    sa.Column('prod_id', sa.Integer(), nullable=False),
+    sa.Column('quantity', sa.Integer(), nullable=False),
+    sa.Column('expires_at', sa.DateTime(timezone=True), nullable=False),
+    sa.ForeignKeyConstraint(['order_id'], ['order.id'], ),
+    sa.ForeignKeyConstraint(['prod_id'], ['product.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('order_id', 'prod_id', name='uq_reservation_order_id_prod_id')
+    )
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.create_index('ix_reservation_expires_at', ['expires_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('reservation', schema=None) as batch_op:
+        batch_op.drop_index('ix_reservation_expires_at')
+
+    op.drop_table('reservation')
+    with op.batch_alter_table('product', schema=None) as batch_op:
+        batch_op.drop_column('reserved')
@@ -0,0 +1,26 @@
+"""order paid_at
+
+Revision ID: 9c4f1b6e2d73
+Revises: 5e2d8a7c4b19
+Create Date: 2026-10-18 15:12:08.514307
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4f1b6e2d73'
+down_revision = '5e2d8a7c4b19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('paid_at', sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('order', schema=None) as batch_op:
+        batch_op.drop_column('paid_at')
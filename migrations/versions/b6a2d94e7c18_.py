@@ -0,0 +1,39 @@
+"""keep paid orders linked to their user
+
+Revision ID: b6a2d94e7c18
+Revises: 9c4f1b6e2d73
+Create Date: 2026-10-18 16:05:37.902114
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6a2d94e7c18'
+down_revision = '9c4f1b6e2d73'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('user_order', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('is_open', sa.Boolean(), server_default=sa.text('true'), nullable=False))
+        batch_op.drop_index('uq_user_order_user_id')
+    op.execute('''
+        UPDATE user_order SET is_open = false WHERE order_id IN (
+            SELECT id FROM "order" WHERE paid_at IS NOT NULL)
+    ''')
+    # El carrito unico por usuario solo aplica a los pedidos abiertos
+    with op.batch_alter_table('user_order', schema=None) as batch_op:
+        batch_op.create_index('uq_user_order_user_id', ['user_id'], unique=True,
+                              postgresql_where=sa.text('is_open'), sqlite_where=sa.text('is_open'))
+
+
+def downgrade():
+    # Sin is_open solo cabe un pedido por usuario: se quitan los enlaces de los pedidos cerrados
+    op.execute('DELETE FROM user_order WHERE NOT is_open')
+    with op.batch_alter_table('user_order', schema=None) as batch_op:
+        batch_op.drop_index('uq_user_order_user_id')
+        batch_op.create_index('uq_user_order_user_id', ['user_id'], unique=True)
+        batch_op.drop_column('is_open')
@@ -0,0 +1,78 @@
+"""association table keys and order_item uniqueness
+
+Revision ID: d51e07a4b9c3
+Revises: a3f1c9d2e8b4
+Create Date: 2026-10-18 11:02:47.918355
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd51e07a4b9c3'
+down_revision = 'a3f1c9d2e8b4'
+branch_labels = None
+depends_on = None
+
+
+# (tabla, columna principal, columna inversa)
+ASSOCIATION_TABLES = [
+    ('user_order', 'user_id', 'order_id'),
+    ('prod_order', 'prod_id', 'order_id'),
+    ('user_fav', 'user_id', 'fav_id'),
+    ('prod_fav', 'prod_id', 'fav_id'),
+]
+
+
+def _dedupe_association(table, left, right):
+    # SQL portable (Postgres y SQLite): nos quedamos con una sola fila por pareja y sin NULLs
+    op.execute(f'CREATE TABLE _dedupe_{table} AS SELECT DISTINCT {left}, {right} FROM {table} '
+               f'WHERE {left} IS NOT NULL AND {right} IS NOT NULL')
+    op.execute(f'DELETE FROM {table}')
+    op.execute(f'INSERT INTO {table} ({left}, {right}) SELECT {left}, {right} FROM _dedupe_{table}')
+    op.execute(f'DROP TABLE _dedupe_{table}')
+
+
+def _dedupe_order_items():
+    # Las lineas repetidas de un mismo pedido se fusionan sumando cantidades en la de menor id
+    op.execute('''
+        UPDATE order_item SET quantity = (
+            SELECT SUM(dup.quantity) FROM order_item dup
+            WHERE dup.order_id = order_item.order_id AND dup.prod_id = order_item.prod_id)
+        WHERE id IN (
+            SELECT MIN(id) FROM order_item GROUP BY order_id, prod_id HAVING COUNT(*) > 1)
+    ''')
+    op.execute('''
+        DELETE FROM order_item WHERE id NOT IN (
+            SELECT keep_id FROM (
+                SELECT MIN(id) AS keep_id FROM order_item GROUP BY order_id, prod_id) AS keep)
+    ''')
+
+
+def upgrade():
+    for table, left, right in ASSOCIATION_TABLES:
+        _dedupe_association(table, left, right)
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.alter_column(left, existing_type=sa.Integer(), nullable=False)
+            batch_op.alter_column(right, existing_type=sa.Integer(), nullable=False)
+            batch_op.create_primary_key(f'pk_{table}', [left, right])
+            batch_op.create_index(f'ix_{table}_{right}', [right], unique=False)
+
+    _dedupe_order_items()
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_order_item_order_id_prod_id', ['order_id', 'prod_id'])
+        batch_op.create_index('ix_order_item_prod_id', ['prod_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('order_item', schema=None) as batch_op:
+        batch_op.drop_index('ix_order_item_prod_id')
+        batch_op.drop_constraint('uq_order_item_order_id_prod_id', type_='unique')
+
+    for table, left, right in reversed(ASSOCIATION_TABLES):
+        with op.batch_alter_table(table, schema=None) as batch_op:
+            batch_op.drop_index(f'ix_{table}_{right}')
+            batch_op.drop_constraint(f'pk_{table}', type_='primary')
+            batch_op.alter_column(right, existing_type=sa.Integer(), nullable=True)
+            batch_op.alter_column(left, existing_type=sa.Integer(), nullable=True)
@@ -0,0 +1,88 @@
+"""one open order per user
+
+Revision ID: f2b8c61d0a57
+Revises: d51e07a4b9c3
+Create Date: 2026-10-18 12:40:09.531274
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2b8c61d0a57'
+down_revision = 'd51e07a4b9c3'
+branch_labels = None
+depends_on = None
+
+
+# Pedidos sobrantes de cada usuario (no son el de menor id) que solo son de ese usuario
+EXTRA_CARTS = '''
+    SELECT uo.order_id AS order_id,
+           (SELECT MIN(k.order_id) FROM user_order k WHERE k.user_id = uo.user_id) AS keep_id
+    FROM user_order uo
+    WHERE uo.order_id > (SELECT MIN(k.order_id) FROM user_order k WHERE k.user_id = uo.user_id)
+'''
+
+
+def _shared_extra_carts():
+    # Usuarios con un pedido sobrante compartido con otro usuario: no se puede fusionar sin mas
+    return op.get_bind().execute(sa.text('''
+        SELECT DISTINCT uo.user_id FROM user_order uo
+        WHERE uo.order_id > (SELECT MIN(k.order_id) FROM user_order k WHERE k.user_id = uo.user_id)
+          AND (SELECT COUNT(*) FROM user_order o WHERE o.order_id = uo.order_id) > 1
+        ORDER BY uo.user_id
+    ''')).scalars().all()
+
+
+def _merge_extra_carts():
+    # Las lineas de los pedidos sobrantes pasan al de menor id del usuario, sumando cantidades
+    op.execute(f'CREATE TABLE _cart_merge AS {EXTRA_CARTS}')
+    op.execute('''
+        UPDATE order_item SET quantity = quantity + (
+            SELECT SUM(dup.quantity) FROM order_item dup
+            JOIN _cart_merge m ON m.order_id = dup.order_id
+            WHERE m.keep_id = order_item.order_id AND dup.prod_id = order_item.prod_id)
+        WHERE order_id IN (SELECT keep_id FROM _cart_merge) AND EXISTS (
+            SELECT 1 FROM order_item dup
+            JOIN _cart_merge m ON m.order_id = dup.order_id
+            WHERE m.keep_id = order_item.order_id AND dup.prod_id = order_item.prod_id)
+    ''')
+    op.execute('''
+        INSERT INTO order_item (order_id, prod_id, quantity)
+        SELECT m.keep_id, dup.prod_id, SUM(dup.quantity) FROM order_item dup
+        JOIN _cart_merge m ON m.order_id = dup.order_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM order_item k WHERE k.order_id = m.keep_id AND k.prod_id = dup.prod_id)
+        GROUP BY m.keep_id, dup.prod_id
+    ''')
+    op.execute('''
+        INSERT INTO prod_order (prod_id, order_id)
+        SELECT DISTINCT p.prod_id, m.keep_id FROM prod_order p
+        JOIN _cart_merge m ON m.order_id = p.order_id
+        WHERE NOT EXISTS (
+            SELECT 1 FROM prod_order k WHERE k.order_id = m.keep_id AND k.prod_id = p.prod_id)
+    ''')
+    # Los pedidos sobrantes quedan vacios y sin usuario: se borran
+    op.execute('DELETE FROM order_item WHERE order_id IN (SELECT order_id FROM _cart_merge)')
+    op.execute('DELETE FROM prod_order WHERE order_id IN (SELECT order_id FROM _cart_merge)')
+    op.execute('DELETE FROM user_order WHERE order_id IN (SELECT order_id FROM _cart_merge)')
+    op.execute('DELETE FROM "order" WHERE id IN (SELECT order_id FROM _cart_merge)')
+    op.execute('DROP TABLE _cart_merge')
+
+
+def upgrade():
+    # Si algun usuario tiene varios pedidos enlazados se fusionan en el de menor id
+    shared = _shared_extra_carts()
+    if shared:
+        raise RuntimeError(
+            "Cannot merge the carts of users %s: some of their orders belong to other users too. "
+            "Fix those user_order rows by hand and run the upgrade again." % ", ".join(map(str, shared)))
+    _merge_extra_carts()
+    with op.batch_alter_table('user_order', schema=None) as batch_op:
+        batch_op.create_index('uq_user_order_user_id', ['user_id'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('user_order', schema=None) as batch_op:
+        batch_op.drop_index('uq_user_order_user_id')
@@ -9,3 +9,4 @@ pip install pipenv
 pipenv install
 
 pipenv run upgrade
+pipenv run startup-tasks
@@ -0,0 +1,20 @@
+# Panel de administracion en su propio proceso (con ADMIN_MODE=off en la API):
+#   gunicorn admin_wsgi --chdir ./src/ --workers 1
+# Solo carga los modelos y flask_admin, no la API.
+
+import os
+from werkzeug.exceptions import NotFound
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
+from api.admin import ADMIN_PREFIX, create_admin_app
+
+db_url = os.getenv("DATABASE_URL", "sqlite:////tmp/test.db")
+application = DispatcherMiddleware(NotFound(), {
+    ADMIN_PREFIX: create_admin_app({
+        "SQLALCHEMY_DATABASE_URI": db_url.replace("postgres://", "postgresql://"),
+        "SQLALCHEMY_TRACK_MODIFICATIONS": False,
+    }),
+})
+
+if __name__ == "__main__":
+    from werkzeug.serving import run_simple
+    run_simple("0.0.0.0", int(os.environ.get("PORT", 3002)), application)
@@ -1,17 +1,65 @@
-  
+"""
+Panel de administracion (flask_admin) como app Flask aparte montada en /admin.
+ADMIN_MODE=lazy (por defecto): se crea en el worker la primera vez que alguien pide /admin,
+asi los workers que solo sirven la API no importan flask_admin.
+ADMIN_MODE=off: /admin no existe en la API; el panel se sirve en otro proceso con
+`gunicorn admin_wsgi --chdir ./src/`.
+"""
 import os
-from flask_admin import Admin
+import threading
+from werkzeug.middleware.dispatcher import DispatcherMiddleware
 from .models import db, User
-from flask_admin.contrib.sqla import ModelView
 
-def setup_admin(app):
+ADMIN_MODE = os.getenv("ADMIN_MODE", "lazy")
+ADMIN_PREFIX = "/admin"
+
+
+def create_admin_app(config):
+    """
+    App Flask solo con el admin. `config` son los ajustes de base de datos de la API
+    (SQLALCHEMY_DATABASE_URI, SQLALCHEMY_BINDS...).
+    """
+    from flask import Flask
+    from flask_admin import Admin
+    from flask_admin.contrib.sqla import ModelView
+
+    app = Flask(__name__)
+    app.config.update(config)
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
-    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
+    db.init_app(app)
+    # La app se sirve bajo ADMIN_PREFIX, asi que dentro el admin cuelga de la raiz
+    admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3', url='/')
 
-    
     # Add your models here, for example this is how we add a the User model to the admin
     admin.add_view(ModelView(User, db.session))
 
     # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    # admin.add_view(ModelView(YourModelName, db.session))
+    return app
+
+
+class LazyAdmin:
+    # Aplicacion WSGI que construye el admin en la primera peticion
+    def __init__(self, config):
+        self.config = config
+        self._app = None
+        self._lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    self._app = create_admin_app(self.config)
+        return self._app(environ, start_response)
+
+
+def admin_config(app):
+    return {key: value for key, value in app.config.items() if key.startswith("SQLALCHEMY_")}
+
+
+def setup_admin(app):
+    app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
+    if ADMIN_MODE == "off":
+        return
+    app.wsgi_app = DispatcherMiddleware(app.wsgi_app, {ADMIN_PREFIX: LazyAdmin(admin_config(app))})
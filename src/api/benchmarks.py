@@ -0,0 +1,265 @@
+"""
+Banco de pruebas de los endpoints mas usados (flask bench-endpoints).
+Lanza las peticiones con el test client de Flask o contra un worker real de gunicorn,
+mide throughput, latencias p50/p95/p99 y consultas SQL por peticion, guarda un
+informe JSON y lo compara con un baseline guardado.
+"""
+import http.client
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from sqlalchemy import event
+from .cache import cart_version
+from .models import db, User, Product, OrderItem, user_order, prod_order, user_fav
+from .timing import percentiles
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Metricas que se comparan con el baseline: (nombre, True si mas alto es peor).
+# p99 se guarda en el informe pero con pocas peticiones es demasiado ruidoso para fallar por el
+COMPARED_METRICS = [("p50", True), ("p95", True), ("rps", False), ("queries_per_request", True)]
+LATENCY_METRICS = {"p50", "p95"}
+# Escenarios que modifican los carritos de la muestra: se restauran al terminar
+CART_WRITE_SCENARIOS = {"POST /my-cart"}
+# Consultas SQL de la peticion en la cabecera Server-Timing de la app (api/timing.py)
+_SERVER_TIMING_QUERIES = re.compile(r'db;[^,]*desc="(\d+) queries"')
+
+
+def load_sample(size=200):
+    # Ids reales del dataset (flask insert-test-data) para construir las peticiones
+    product_ids = db.session.execute(
+        db.select(Product.id).where(Product.amount > 0).limit(size)).scalars().all()
+    cart_users = db.session.execute(
+        db.select(user_order.c.user_id).where(user_order.c.is_open).limit(size)).scalars().all()
+    fav_users = db.session.execute(db.select(user_fav.c.user_id).distinct().limit(size)).scalars().all()
+    logins = db.session.execute(
+        db.select(User.email, User.password).where(User.is_active.is_(True)).limit(size)).all()
+    if not (product_ids and cart_users and fav_users and logins):
+        raise RuntimeError("The database has no data to benchmark, run `flask insert-test-data` first")
+    return {"product_ids": product_ids, "cart_users": cart_users, "fav_users": fav_users,
+            "logins": [{"email": email, "password": password} for email, password in logins]}
+
+
+def scenarios(sample):
+    """
+    Cada escenario es (nombre, funcion i -> (metodo, ruta, cuerpo json)).
+    """
+    products, carts, favs, logins = (sample["product_ids"], sample["cart_users"],
+                                     sample["fav_users"], sample["logins"])
+    return [
+        ("GET /products", lambda i: ("GET", "/products", None)),
+        ("GET /products/<id>", lambda i: ("GET", f"/products/{products[i % len(products)]}", None)),
+        ("GET /my-cart/<user_id>", lambda i: ("GET", f"/my-cart/{carts[i % len(carts)]}", None)),
+        ("POST /my-cart", lambda i: ("POST", "/my-cart", {
+            "item": {"id": products[i % len(products)]},
+            "currentUser": {"id": carts[i % len(carts)]}})),
+        ("GET /my-favorites/<user_id>", lambda i: ("GET", f"/my-favorites/{favs[i % len(favs)]}", None)),
+        ("POST /login", lambda i: ("POST", "/login", logins[i % len(logins)])),
+    ]
+
+
+class ClientDriver:
+    # Peticiones en proceso con el test client de Flask. Cuenta las consultas SQL
+
+    def __init__(self, app):
+        self.app = app
+        self.queries = 0
+        self._engine = db.engine
+
+    def __enter__(self):
+        event.listen(self._engine, "before_cursor_execute", self._count)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self._engine, "before_cursor_execute", self._count)
+
+    def _count(self, *args):
+        self.queries += 1
+
+    def session(self):
+        client = self.app.test_client()
+
+        def send(method, path, body):
+            return client.open(path, method=method, json=body).status_code
+        return send
+
+
+class GunicornDriver:
+    """
+    Arranca un worker real de gunicorn con la misma configuracion (gunicorn.conf.py) y le
+    habla por HTTP. Las consultas SQL se leen de la cabecera Server-Timing de cada respuesta.
+    """
+
+    def __init__(self, workers=1, threads=1):
+        self.workers = workers
+        self.threads = threads
+        self.queries = 0
+        self.process = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            self.port = sock.getsockname()[1]
+        # Directorio de metricas propio: on_starting borra el suyo y no debe tocar el de la instancia
+        self.metrics_dir = tempfile.mkdtemp(prefix="bench-metrics-")
+        env = dict(os.environ, SERVER_TIMING="1", PROMETHEUS_MULTIPROC_DIR=self.metrics_dir)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "gunicorn", "wsgi", "--chdir", SRC_DIR,
+             "-c", os.path.join(SRC_DIR, "gunicorn.conf.py"),
+             "--bind", f"127.0.0.1:{self.port}", "--workers", str(self.workers),
+             "--threads", str(self.threads), "--log-level", "warning"],
+            env=env)
+        deadline = time.monotonic() + 30
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError("gunicorn exited during startup")
+            try:
+                with socket.create_connection(("127.0.0.1", self.port), timeout=0.5):
+                    return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__()
+        raise RuntimeError("gunicorn did not start in 30s")
+
+    def __exit__(self, *exc):
+        if self.process is not None:
+            self.process.terminate()
+            self.process.wait(timeout=10)
+        shutil.rmtree(self.metrics_dir, ignore_errors=True)
+
+    def session(self):
+        connection = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+
+        def send(method, path, body):
+            headers = {}
+            payload = None
+            if body is not None:
+                payload = json.dumps(body)
+                headers["Content-Type"] = "application/json"
+            connection.request(method, path, body=payload, headers=headers)
+            response = connection.getresponse()
+            response.read()
+            match = _SERVER_TIMING_QUERIES.search(response.getheader("Server-Timing") or "")
+            if match:
+                with self._lock:
+                    self.queries += int(match.group(1))
+            return response.status
+        return send
+
+
+def run_scenario(driver, build, requests, concurrency):
+    def worker(offset):
+        send = driver.session()
+        latencies, errors = [], 0
+        for i in range(offset, requests, concurrency):
+            method, path, body = build(i)
+            start = time.perf_counter()
+            status = send(method, path, body)
+            latencies.append(time.perf_counter() - start)
+            errors += status >= 500
+        return latencies, errors
+
+    queries_before = driver.queries
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies = [latency for result in results for latency in result[0]]
+    report = {
+        "requests": len(latencies),
+        "errors": sum(result[1] for result in results),
+        "rps": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        **percentiles(latencies),
+        "queries_per_request": None,
+    }
+    if queries_before is not None:
+        report["queries_per_request"] = round((driver.queries - queries_before) / max(1, len(latencies)), 2)
+    return report
+
+
+def snapshot_carts(user_ids):
+    # Lineas y enlaces producto-pedido de los carritos abiertos de estos usuarios
+    order_ids = db.session.execute(
+        db.select(user_order.c.order_id)
+        .where(user_order.c.user_id.in_(user_ids), user_order.c.is_open)).scalars().all()
+    items = db.session.execute(
+        db.select(OrderItem.order_id, OrderItem.prod_id, OrderItem.quantity)
+        .where(OrderItem.order_id.in_(order_ids))).all()
+    links = db.session.execute(
+        db.select(prod_order.c.prod_id, prod_order.c.order_id)
+        .where(prod_order.c.order_id.in_(order_ids))).all()
+    db.session.commit()
+    return {"order_ids": order_ids, "items": [row._asdict() for row in items],
+            "links": [row._asdict() for row in links]}
+
+
+def restore_carts(user_ids, snapshot):
+    # Deja los carritos como estaban en el snapshot, asi cada ejecucion parte del mismo estado
+    order_ids = snapshot["order_ids"]
+    db.session.execute(db.delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+    db.session.execute(db.delete(prod_order).where(prod_order.c.order_id.in_(order_ids)))
+    if snapshot["items"]:
+        db.session.execute(db.insert(OrderItem), snapshot["items"])
+    if snapshot["links"]:
+        db.session.execute(db.insert(prod_order), snapshot["links"])
+    db.session.commit()
+    for user_id in set(user_ids):
+        cart_version.bump_user(user_id)
+
+
+def run_benchmarks(driver, sample, requests=200, concurrency=1, warmup=10):
+    endpoints = {}
+    for name, build in scenarios(sample):
+        snapshot = snapshot_carts(sample["cart_users"]) if name in CART_WRITE_SCENARIOS else None
+        try:
+            run_scenario(driver, build, warmup, 1)
+            endpoints[name] = run_scenario(driver, build, requests, concurrency)
+        finally:
+            if snapshot is not None:
+                restore_carts(sample["cart_users"], snapshot)
+    return endpoints
+
+
+def compare(report, baseline, margin, noise_ms=1.0):
+    """
+    Devuelve la lista de regresiones respecto al baseline: cada metrica puede empeorar
+    como mucho `margin` (0.2 = 20%). Las latencias ademas toleran `noise_ms` absolutos,
+    para que un endpoint de 0.5 ms no falle por 0.2 ms de ruido.
+    """
+    regressions = []
+    for name, current in report["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(name)
+        if not previous:
+            continue
+        if current["errors"] > previous.get("errors", 0):
+            regressions.append(f"{name} errors: {previous.get('errors', 0)} -> {current['errors']}")
+        for metric, higher_is_worse in COMPARED_METRICS:
+            old, new = previous.get(metric), current.get(metric)
+            if old is None or new is None:
+                continue
+            limit = old * (1 + margin) if higher_is_worse else old * (1 - margin)
+            if metric in LATENCY_METRICS:
+                limit = max(limit, old + noise_ms)
+            if (new > limit) if higher_is_worse else (new < limit):
+                regressions.append(f"{name} {metric}: {old} -> {new} (limit {round(limit, 2)})")
+    return regressions
+
+
+def build_report(mode, endpoints):
+    return {
+        "mode": mode,
+        "database": db.engine.dialect.name,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "endpoints": endpoints,
+    }
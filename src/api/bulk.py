@@ -0,0 +1,283 @@
+"""
+Carga masiva para los endpoints POST de /users, /products, /orders y /order_items.
+El cuerpo (un array JSON) se lee en streaming, las filas se validan por bloques
+y se insertan con un unico INSERT ... RETURNING por bloque (executemany).
+Los errores se devuelven por fila sin abortar el resto de la carga.
+"""
+import codecs
+import json
+from datetime import datetime
+from sqlalchemy import Boolean, DateTime, Enum, Integer, String, tuple_
+from sqlalchemy.exc import DBAPIError
+from werkzeug.http import parse_date
+from .models import db, dialect_insert
+
+CHUNK_SIZE = 1000
+READ_SIZE = 64 * 1024
+
+
+class BulkParseError(ValueError):
+    pass
+
+
+def iter_json_array(stream):
+    """
+    Recorre los elementos de un array JSON leyendo el stream por trozos,
+    sin cargar ni parsear el cuerpo entero de una vez.
+    """
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    started = False
+    after_element = after_comma = False
+    eof = False
+
+    def read_more():
+        # Anade el siguiente trozo al buffer. Devuelve False al llegar al final del cuerpo
+        nonlocal buffer, position, eof
+        chunk = stream.read(READ_SIZE)
+        buffer = buffer[position:] + utf8.decode(chunk, final=not chunk)
+        position = 0
+        if not chunk:
+            eof = True
+        return bool(chunk)
+
+    while True:
+        while position < len(buffer) and buffer[position] in " \t\r\n":
+            position += 1
+        if position >= len(buffer):
+            if eof or not read_more():
+                raise BulkParseError("Unexpected end of body, expected a JSON array")
+            continue
+
+        char = buffer[position]
+        if not started:
+            if char != "[":
+                raise BulkParseError("Request body must be a JSON array")
+            started = True
+            position += 1
+            continue
+        if char == "]":
+            if after_comma:
+                raise BulkParseError("Invalid JSON in request body")
+            return
+        if char == ",":
+            if not after_element:
+                raise BulkParseError("Invalid JSON in request body")
+            after_element, after_comma = False, True
+            position += 1
+            continue
+        if after_element:
+            raise BulkParseError("Invalid JSON in request body")
+
+        try:
+            element, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError:
+            # El elemento puede estar partido entre dos trozos: leer mas y reintentar
+            if eof or not read_more():
+                raise BulkParseError("Invalid JSON in request body")
+            continue
+        # Un numero al final del buffer podria seguir en el siguiente trozo
+        if end == len(buffer) and not eof and read_more():
+            continue
+        yield element
+        position = end
+        after_element, after_comma = True, False
+
+
+def _convert(column, value):
+    column_type = column.type
+    if isinstance(column_type, Enum):
+        enum_class = column_type.enum_class
+        if isinstance(value, enum_class):
+            return value
+        if isinstance(value, str):
+            if value in enum_class.__members__:
+                return enum_class[value]
+            try:
+                return enum_class(value.lower())
+            except ValueError:
+                pass
+        raise ValueError(f"must be one of {', '.join(member.value for member in enum_class)}")
+    if isinstance(column_type, Boolean):
+        if not isinstance(value, bool):
+            raise ValueError("must be a boolean")
+        return value
+    if isinstance(column_type, Integer):
+        if isinstance(value, bool) or not isinstance(value, int):
+            raise ValueError("must be an integer")
+        return value
+    if isinstance(column_type, String):
+        if not isinstance(value, str):
+            raise ValueError("must be a string")
+        if column_type.length and len(value) > column_type.length:
+            raise ValueError(f"must be at most {column_type.length} characters")
+        return value
+    if isinstance(column_type, DateTime):
+        if isinstance(value, str):
+            try:
+                return datetime.fromisoformat(value)
+            except ValueError:
+                parsed = parse_date(value)
+                if parsed is not None:
+                    return parsed
+        raise ValueError("must be an ISO 8601 or HTTP date")
+    return value
+
+
+class RowValidator:
+    # Valida y convierte una fila del JSON contra las columnas de la tabla del modelo
+
+    def __init__(self, model):
+        self.table = model.__table__
+        self.columns = {column.key: column for column in self.table.columns}
+        self.required = [
+            column.key for column in self.table.columns
+            if not column.nullable and column.default is None and column.server_default is None
+            and not (column.primary_key and column.autoincrement in (True, "auto"))]
+
+    def __call__(self, row):
+        if not isinstance(row, dict):
+            raise ValueError("must be an object")
+        unknown = set(row) - set(self.columns)
+        if unknown:
+            raise ValueError(f"unknown fields: {', '.join(sorted(unknown))}")
+        missing = [key for key in self.required if row.get(key) is None]
+        if missing:
+            raise ValueError(f"missing fields: {', '.join(missing)}")
+        clean = {}
+        for key, value in row.items():
+            if value is None:
+                if not self.columns[key].nullable:
+                    raise ValueError(f"'{key}' can not be null")
+                clean[key] = None
+                continue
+            try:
+                clean[key] = _convert(self.columns[key], value)
+            except ValueError as e:
+                raise ValueError(f"'{key}' {e}")
+        return clean
+
+
+def _error_message(error):
+    # Primera linea del error del driver, sin el SQL
+    return str(getattr(error, "orig", error)).strip().splitlines()[0]
+
+
+def _insert(model, serializer, rows):
+    return db.session.execute(
+        db.insert(model).returning(*serializer.columns, sort_by_parameter_order=True),
+        rows).all()
+
+
+def _insert_chunk(model, serializer, chunk, created, errors):
+    # chunk: lista de (indice, fila limpia). Se agrupan por columnas para el executemany
+    groups = {}
+    for index, row in chunk:
+        groups.setdefault(tuple(sorted(row)), []).append((index, row))
+
+    for group in groups.values():
+        try:
+            with db.session.begin_nested():
+                rows = _insert(model, serializer, [row for _, row in group])
+            created.extend(rows)
+            continue
+        except DBAPIError:
+            pass
+        # Algun registro del bloque falla (FK, unique...): se repite fila a fila para aislarlo
+        for index, row in group:
+            try:
+                with db.session.begin_nested():
+                    created.extend(_insert(model, serializer, [row]))
+            except DBAPIError as e:
+                errors.append({"index": index, "message": _error_message(e)})
+
+
+def bulk_insert(model, serializer, items, chunk_size=CHUNK_SIZE):
+    """
+    Inserta las filas de `items` (cualquier iterable, p.ej. iter_json_array) y devuelve
+    (filas creadas serializadas, errores). Cada error lleva el indice de la fila en la entrada.
+    No hace commit: lo decide quien llama.
+    """
+    validate = RowValidator(model)
+    created, errors, chunk = [], [], []
+
+    for index, item in enumerate(items):
+        try:
+            chunk.append((index, validate(item)))
+        except ValueError as e:
+            errors.append({"index": index, "message": str(e)})
+        if len(chunk) >= chunk_size:
+            _insert_chunk(model, serializer, chunk, created, errors)
+            chunk = []
+    if chunk:
+        _insert_chunk(model, serializer, chunk, created, errors)
+
+    errors.sort(key=lambda error: error["index"])
+    return serializer.to_dicts(created), errors
+
+
+def _chunks(values, size):
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+def parse_link_rows(rows, keys):
+    # Filas de una tabla de enlace: cada una con los enteros `keys`. Quita duplicados
+    if not isinstance(rows, list):
+        raise BulkParseError("Request body must be a JSON array")
+    links = set()
+    for index, row in enumerate(rows):
+        try:
+            values = tuple(row[key] for key in keys)
+        except (KeyError, TypeError):
+            raise BulkParseError(f"Row {index}: expected fields {', '.join(keys)}")
+        if not all(isinstance(value, int) and not isinstance(value, bool) for value in values):
+            raise BulkParseError(f"Row {index}: {', '.join(keys)} must be integers")
+        links.add(values)
+    return [dict(zip(keys, values)) for values in sorted(links)]
+
+
+def missing_references(links, references, chunk_size=CHUNK_SIZE):
+    """
+    Comprueba con una consulta IN (...) por entidad que existen todos los ids referenciados.
+    `references` es {clave: Modelo}. Devuelve {clave: [ids que no existen]}.
+    """
+    missing = {}
+    for key, model in references.items():
+        wanted = {link[key] for link in links}
+        found = set()
+        for ids in _chunks(wanted, chunk_size):
+            found.update(db.session.execute(db.select(model.id).where(model.id.in_(ids))).scalars())
+        if wanted - found:
+            missing[key] = sorted(wanted - found)
+    return missing
+
+
+def insert_links(table, links, chunk_size=CHUNK_SIZE):
+    """
+    INSERT multi-fila que ignora los enlaces que ya existen, sin cargar ninguna coleccion.
+    Devuelve (enlaces insertados, enlaces rechazados): los rechazados no existian pero
+    chocan con otro indice unico de la tabla (p.ej. un segundo carrito abierto en user_order).
+    """
+    inserted, rejected = [], []
+    for rows in _chunks(links, chunk_size):
+        keys = list(rows[0])
+        columns = [table.c[key] for key in keys]
+        added = set(db.session.execute(
+            dialect_insert(table).values(rows).on_conflict_do_nothing().returning(*columns)).tuples())
+        skipped = [tuple(row[key] for key in keys) for row in rows]
+        skipped = [values for values in skipped if values not in added]
+        existing = set()
+        if skipped:
+            existing = set(db.session.execute(
+                db.select(*columns).where(tuple_(*columns).in_(skipped))).tuples())
+        for row in rows:
+            values = tuple(row[key] for key in keys)
+            if values in added:
+                inserted.append(row)
+            elif values not in existing:
+                rejected.append(row)
+    return inserted, rejected
@@ -0,0 +1,173 @@
+import os
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+
+class LRUCache:
+    """
+    Cache LRU en memoria con TTL y contadores de hits/misses/evictions.
+    Es thread-safe para poder usarse desde los hilos de gunicorn.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        # Funcion opcional on_lookup(hit) para exportar los hits/misses (ver api/metrics.py)
+        self.on_lookup = None
+
+    def get(self, key):
+        with self._lock:
+            value = self._get(key)
+        if self.on_lookup is not None:
+            self.on_lookup(value is not None)
+        return value
+
+    def _get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+class SharedVersion:
+    """
+    Version (del catalogo, de los carritos...) guardada como el mtime de un fichero local,
+    asi todos los workers de gunicorn de la misma maquina ven el mismo valor sin tocar la DB.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def current(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return 0
+
+    def bump(self):
+        now = time.time_ns()
+        # Garantiza que la version avance aunque el reloj no lo haga
+        now = max(now, self.current() + 1)
+        with open(self.path, "a"):
+            pass
+        os.utime(self.path, ns=(now, now))
+        return now
+
+    def seed(self):
+        # Sin fichero (maquina nueva, /tmp limpio) current() valdria 0 como en el arranque
+        # anterior y un ETag viejo volveria a coincidir: se crea con la hora actual
+        if not os.path.exists(self.path):
+            self.bump()
+
+
+class UserVersions(SharedVersion):
+    """
+    Versiones por usuario (carrito, favoritos): un fichero por usuario junto a `path`,
+    asi la escritura de un usuario solo invalida su propia entrada de la cache.
+    current()/bump() siguen siendo la ultima escritura de cualquier usuario
+    (la usa @read_replica para saber si la replica puede ir con retraso).
+    bump_all() invalida a todos (cargas masivas en las que no se sabe a quien afectan).
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._all = SharedVersion(f"{path}.all")
+
+    def _user(self, user_id):
+        return SharedVersion(f"{self.path}.{int(user_id)}")
+
+    def current_for(self, user_id):
+        return self._all.current(), self._user(user_id).current()
+
+    def bump_user(self, user_id):
+        self._user(user_id).bump()
+        return self.bump()
+
+    def bump_all(self):
+        self._all.bump()
+        return self.bump()
+
+
+def make_etag(*parts):
+    # ETag fuerte: depende solo de la version del catalogo y de la clave pedida
+    raw = "|".join(str(part) for part in parts)
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+product_cache = LRUCache(
+    maxsize=int(os.getenv("PRODUCT_CACHE_SIZE", 2048)),
+    ttl=int(os.getenv("PRODUCT_CACHE_TTL", 300)))
+
+catalog_version = SharedVersion(os.getenv(
+    "CATALOG_VERSION_FILE", os.path.join(tempfile.gettempdir(), "catalog.version")))
+
+# Carritos por usuario. Cada cambio en un carrito sube la version de su usuario para que
+# ningun worker sirva un carrito viejo despues de una escritura (read-your-writes).
+cart_cache = LRUCache(
+    maxsize=int(os.getenv("CART_CACHE_SIZE", 4096)),
+    ttl=int(os.getenv("CART_CACHE_TTL", 60)))
+
+cart_version = UserVersions(os.getenv(
+    "CART_VERSION_FILE", os.path.join(tempfile.gettempdir(), "cart.version")))
+
+# Conjunto de ids de productos favoritos de cada usuario
+favorites_cache = LRUCache(
+    maxsize=int(os.getenv("FAVORITES_CACHE_SIZE", 4096)),
+    ttl=int(os.getenv("FAVORITES_CACHE_TTL", 300)))
+
+favorites_version = UserVersions(os.getenv(
+    "FAVORITES_VERSION_FILE", os.path.join(tempfile.gettempdir(), "favorites.version")))
+
+# Usuario de cada token JWT (api/identity.py). Cualquier cambio en un usuario sube
+# identity_version, asi un usuario desactivado deja de resolverse en todos los workers.
+identity_cache = LRUCache(
+    maxsize=int(os.getenv("IDENTITY_CACHE_SIZE", 4096)),
+    ttl=int(os.getenv("IDENTITY_CACHE_TTL", 60)))
+
+identity_version = SharedVersion(os.getenv(
+    "IDENTITY_VERSION_FILE", os.path.join(tempfile.gettempdir(), "identity.version")))
@@ -1,12 +1,38 @@
 
 import click
-from api.models import db, User
+import json
+import os
+import subprocess
+import sys
+import threading
+from sqlalchemy import func
+import random
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from flask.json.provider import DefaultJSONProvider
+from api.timing import percentiles
+from api.models import db, User, Product, Order, OrderItem, Reservation, RoleEnum, CategoryEnum, user_order, user_fav, prod_order
 
 """
 In this file, you can add as many commands as you want using the @app.cli.command decorator
 Flask commands are usefull to run cronjobs or tasks outside of the API but sill in integration 
 with youy database, for example: Import the price of bitcoin every night as 12am
 """
+
+
+# Modulos pesados que la app solo importa cuando se usan (checkout, admin)
+LAZY_MODULES = ("stripe", "requests", "flask_admin", "flask_swagger")
+
+SEARCH_WORDS = [
+    "lampara", "madera", "bronce", "marmol", "escultura", "estatua", "ceramica", "vidrio",
+    "artesanal", "moderna", "clasica", "abstracta", "figura", "mesa", "pie", "colgante",
+    "lamp", "wooden", "bronze", "marble", "sculpture", "statue", "ceramic", "glass",
+    "handmade", "modern", "classic", "abstract", "figure", "table", "floor", "pendant",
+]
+
+
 def setup_commands(app):
     
     """ 
@@ -14,21 +40,590 @@ def setup_commands(app):
     by typing: $ flask insert-test-users 5
     Note: 5 is the number of users to add
     """
+    @app.cli.command("run-startup-tasks")
+    @click.option("--task", "tasks", multiple=True, help="Run only this task (repeatable)")
+    @click.option("--list", "list_tasks", is_flag=True, help="List the registered tasks")
+    def startup_tasks(tasks, list_tasks):
+        """
+        Tareas de arranque de api/startup.py. Se ejecuta una vez por despliegue
+        (paso release del Procfile); sale con codigo 1 si alguna falla.
+        """
+        from api.startup import STARTUP_TASKS, run_startup_tasks
+        if list_tasks:
+            print("\n".join(STARTUP_TASKS))
+            return
+        try:
+            results = run_startup_tasks(tasks)
+        except KeyError as e:
+            raise click.UsageError(e.args[0])
+        if results is None:
+            print("Startup tasks are already running in another instance, skipped")
+            return
+        for name, seconds, error in results:
+            print(f"{name}: {'FAILED ' + error if error else 'ok'} ({seconds * 1000:.1f} ms)")
+        if any(error for name, seconds, error in results):
+            raise SystemExit(1)
+
+    @app.cli.command("bench-boot")
+    @click.option("--runs", default=5, help="Fresh interpreters to start")
+    @click.option("--max-import-ms", default=1000.0, help="Budget for the median import time")
+    @click.option("--max-rss-mb", default=100.0, help="Budget for the peak RSS after import")
+    @click.option("--top", default=10, help="Slowest modules to show from -X importtime")
+    def bench_boot(runs, max_import_ms, max_rss_mb, top):
+        """
+        Coste de arrancar un worker: importar la app (lo que hace gunicorn), en interpretes
+        nuevos. Falla (codigo 1) si la mediana del tiempo o la memoria superan el presupuesto,
+        si la importacion abre conexiones a la base de datos o si carga alguno de los
+        modulos que solo se importan al usarse (LAZY_MODULES).
+        """
+        probe = (
+            "import json, resource, sys, time\n"
+            "from sqlalchemy import event\n"
+            "from sqlalchemy.pool import Pool\n"
+            "connections = []\n"
+            "event.listen(Pool, 'connect', lambda *args: connections.append(1))\n"
+            "start = time.perf_counter()\n"
+            "import wsgi\n"
+            "seconds = time.perf_counter() - start\n"
+            "rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+            "print(json.dumps({'seconds': seconds, 'connections': len(connections),\n"
+            "                  'rss_mb': rss / (1024 * 1024 if sys.platform == 'darwin' else 1024),\n"
+            f"                  'lazy': [name for name in {LAZY_MODULES!r} if name in sys.modules]}}))\n")
+        src_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        runs_data = []
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, "-c", probe], cwd=src_dir,
+                                    capture_output=True, text=True, check=True).stdout
+            runs_data.append(json.loads(output.strip().splitlines()[-1]))
+
+        # Desglose por modulo: import time: self [us] | cumulative | nombre
+        importtime = subprocess.run([sys.executable, "-X", "importtime", "-c", "import wsgi"], cwd=src_dir,
+                                    capture_output=True, text=True, check=True).stderr
+        modules = []
+        for line in importtime.splitlines():
+            parts = line.removeprefix("import time:").split("|")
+            if len(parts) == 3 and parts[0].strip().isdigit():
+                modules.append((int(parts[0]), int(parts[1]), parts[2].strip()))
+        print("slowest modules (self / cumulative ms):")
+        for own, cumulative, name in sorted(modules, reverse=True)[:top]:
+            print(f"  {own / 1000:8.1f} {cumulative / 1000:8.1f}  {name}")
+
+        timings = percentiles([run["seconds"] for run in runs_data])
+        rss_mb = max(run["rss_mb"] for run in runs_data)
+        connections = sum(run["connections"] for run in runs_data)
+        lazy = sorted({name for run in runs_data for name in run["lazy"]})
+        print(f"worker import time over {runs} runs: {timings} ms (budget {max_import_ms:.0f} ms)")
+        print(f"peak RSS after import: {rss_mb:.1f} MB (budget {max_rss_mb:.0f} MB)")
+
+        failures = []
+        if timings["p50"] > max_import_ms:
+            failures.append(f"import time {timings['p50']} ms over budget")
+        if rss_mb > max_rss_mb:
+            failures.append(f"RSS {rss_mb:.1f} MB over budget")
+        if connections:
+            failures.append(f"{connections} database connections opened at import")
+        if lazy:
+            failures.append(f"lazy modules imported at startup: {', '.join(lazy)}")
+        print("OK: startup within budget" if not failures else "FAIL: " + "; ".join(failures))
+        if failures:
+            raise SystemExit(1)
+
     @app.cli.command("insert-test-users") # name of our command
     @click.argument("count") # argument of out command
     def insert_test_users(count):
         print("Creating test users")
-        for x in range(1, int(count) + 1):
-            user = User()
-            user.email = "test_user" + str(x) + "@test.com"
-            user.password = "123456"
-            user.is_active = True
-            db.session.add(user)
-            db.session.commit()
-            print("User: ", user.email, " created.")
+        users = [User(email="test_user" + str(x) + "@test.com", password="123456",
+                      firstname="Test", lastname="User " + str(x),
+                      rol=RoleEnum.COSTUMER, is_active=True)
+                 for x in range(1, int(count) + 1)]
+        db.session.add_all(users)
+        db.session.commit()
 
         print("All test users created")
 
     @app.cli.command("insert-test-data")
-    def insert_test_data():
-        pass
\ No newline at end of file
+    @click.option("--users", default=10000, help="Customers to create")
+    @click.option("--artists", default=200, help="Artists to create")
+    @click.option("--products", default=20000, help="Products to create")
+    @click.option("--carts", default=5000, help="Customers with a cart")
+    @click.option("--favorites", default=50000, help="Favorites to create")
+    @click.option("--seed", default=42, help="Random seed, the same seed gives the same data")
+    @click.option("--chunk-size", default=10000, help="Rows per insert/COPY and commit")
+    def insert_test_data(users, artists, products, carts, favorites, seed, chunk_size):
+        """
+        Dataset sintetico y reproducible para pruebas de rendimiento, por ejemplo:
+        $ flask insert-test-data --users 1000000 --products 200000 --carts 300000 --favorites 2000000
+        """
+        from api.dataset import generate_dataset
+
+        start = time.perf_counter()
+        counts = generate_dataset(users=users, artists=artists, products=products, carts=carts,
+                                  favorites=favorites, seed=seed, chunk_size=chunk_size)
+        elapsed = time.perf_counter() - start
+        for table, count in counts.items():
+            print(f"{table}: {count} rows")
+        print(f"{sum(counts.values())} rows in {elapsed:.1f}s")
+
+    @app.cli.command("bench-serialization")
+    @click.option("--rows", default=10000, help="Number of synthetic products to serialize")
+    @click.option("--repeat", default=5, help="Best of N runs")
+    def bench_serialization(rows, repeat):
+        """
+        Compara Product.serialize() + jsonify con el serializador compilado de api.serializers.
+        No necesita base de datos: usa productos en memoria.
+        """
+        from api.serializers import product_serializer, orjson
+
+        now = datetime.now(timezone.utc)
+        categories = list(CategoryEnum)
+        products = [Product(id=i, artist_id=i % 50, name=f"Product {i}",
+                            category=categories[i % len(categories)],
+                            details="Lorem ipsum dolor sit amet " * 4, amount=i % 10,
+                            price=1000 + i, discount=0, img_path=f"/img/{i}.jpg",
+                            created_at=now) for i in range(rows)]
+        rows_data = [tuple(getattr(p, key) for key in product_serializer.keys) for p in products]
+
+        # El camino anterior: serialize() por fila + el proveedor JSON por defecto de Flask
+        default_json = DefaultJSONProvider(app)
+
+        def old_path():
+            return default_json.response([p.serialize() for p in products]).get_data()
+
+        def new_path():
+            return product_serializer.dumps(rows_data)
+
+        print(f"Serializing {rows} products (orjson: {'yes' if orjson else 'no'})")
+        old = min(timeit.repeat(old_path, number=1, repeat=repeat))
+        new = min(timeit.repeat(new_path, number=1, repeat=repeat))
+        print(f"serialize() + jsonify: {old * 1000:.1f} ms")
+        print(f"compiled serializer:  {new * 1000:.1f} ms")
+        print(f"speedup:              {old / new:.1f}x")
+
+    @app.cli.command("bench-cart-favs")
+    @click.option("--users", default=200, help="Number of users with cart/favorites to sample")
+    @click.option("--repeat", default=3, help="Times each user is requested")
+    def bench_cart_favs(users, repeat):
+        """
+        Latencia de GET /my-cart/<user_id> y GET /my-favorites/<user_id> contra la base de datos actual.
+        Para comparar indices: cargar datos con `flask insert-test-data`, ejecutar este comando,
+        hacer `flask db upgrade` (o downgrade) y volver a ejecutarlo.
+        """
+        cart_users = db.session.execute(
+            db.select(user_order.c.user_id).distinct().limit(users)).scalars().all()
+        fav_users = db.session.execute(
+            db.select(user_fav.c.user_id).distinct().limit(users)).scalars().all()
+        client = app.test_client()
+
+        for label, path, ids in (("cart", "/my-cart/{}", cart_users),
+                                 ("favorites", "/my-favorites/{}", fav_users)):
+            latencies = []
+            for _ in range(repeat):
+                for user_id in ids:
+                    start = time.perf_counter()
+                    client.get(path.format(user_id))
+                    latencies.append(time.perf_counter() - start)
+            print(f"{label}: {len(ids)} users, {len(latencies)} requests, {percentiles(latencies)} ms")
+
+    @app.cli.command("stress-add-to-cart")
+    @click.option("--threads", default=8, help="Concurrent clients")
+    @click.option("--clicks", default=50, help="Add-to-cart requests per client")
+    @click.option("--stock", default=100, help="Units in stock of the contended product")
+    def stress_add_to_cart(threads, clicks, stock):
+        """
+        Varios hilos pulsan "anadir al carrito" sobre el mismo producto y el mismo usuario
+        contra la base de datos configurada. Comprueba que nunca se supera el stock
+        y muestra la latencia p50/p99 de POST /my-cart. Borra sus datos al terminar.
+        """
+        suffix = time.time_ns()
+        user = User(firstname="Stress", lastname="Test", email=f"stress_{suffix}@test.com",
+                    password="123456", rol=RoleEnum.COSTUMER, is_active=True)
+        db.session.add(user)
+        db.session.flush()
+        product = Product(artist_id=user.id, name=f"Stress {suffix}", category=CategoryEnum.LAMPS,
+                          details="Contended product", amount=stock, price=100, discount=0,
+                          img_path="/stress.jpg")
+        db.session.add(product)
+        db.session.commit()
+        user_id, prod_id = user.id, product.id
+
+        def click_loop(_):
+            client = app.test_client()
+            latencies, added = [], 0
+            for _ in range(clicks):
+                start = time.perf_counter()
+                response = client.post("/my-cart", json={"item": {"id": prod_id},
+                                                         "currentUser": {"id": user_id}})
+                latencies.append(time.perf_counter() - start)
+                added += response.status_code == 201
+            return latencies, added
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(click_loop, range(threads)))
+        elapsed = time.perf_counter() - started
+
+        latencies = [latency for result in results for latency in result[0]]
+        added = sum(result[1] for result in results)
+        quantity = db.session.execute(
+            db.select(func.sum(OrderItem.quantity)).where(OrderItem.prod_id == prod_id)).scalar() or 0
+
+        print(f"{len(latencies)} requests in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/s)")
+        print(f"latency: {percentiles(latencies)} ms")
+        print(f"successful adds: {added}, quantity in cart: {quantity}, stock: {stock}")
+        oversold = quantity > stock or quantity != added
+        print("OK: no overselling" if not oversold else "FAIL: stock guard broken")
+
+        order_ids = db.session.execute(
+            db.select(user_order.c.order_id).where(user_order.c.user_id == user_id)).scalars().all()
+        db.session.execute(db.delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+        db.session.execute(db.delete(prod_order).where(prod_order.c.order_id.in_(order_ids)))
+        db.session.execute(db.delete(user_order).where(user_order.c.user_id == user_id))
+        db.session.execute(db.delete(Order).where(Order.id.in_(order_ids)))
+        db.session.execute(db.delete(Product).where(Product.id == prod_id))
+        db.session.execute(db.delete(User).where(User.id == user_id))
+        db.session.commit()
+        if oversold:
+            raise SystemExit(1)
+
+    @app.cli.command("bench-search")
+    @click.option("--products", default=500000, help="Catalog size to benchmark against")
+    @click.option("--queries", default=200, help="Number of searches to run")
+    @click.option("--keep", is_flag=True, help="Keep the synthetic products afterwards")
+    def bench_search(products, queries, keep):
+        """
+        Latencia de GET /products/search sobre un catalogo de --products productos.
+        Si el catalogo es mas pequeno se completa con productos sinteticos (img_path
+        /bench/search.jpg) que se borran al terminar salvo con --keep.
+        Requiere la migracion de busqueda aplicada (flask db upgrade).
+        """
+        artist_id = db.session.execute(db.select(User.id).limit(1)).scalar()
+        if artist_id is None:
+            print("No users found, run `flask insert-test-data` first")
+            return
+
+        rng = random.Random(42)
+        categories = list(CategoryEnum)
+        existing = db.session.execute(db.select(func.count(Product.id))).scalar()
+        missing = max(0, products - existing)
+        now = datetime.now(timezone.utc)
+        print(f"Catalog has {existing} products, adding {missing} synthetic ones")
+        for start in range(0, missing, 10000):
+            db.session.execute(db.insert(Product), [{
+                "artist_id": artist_id,
+                "name": " ".join(rng.choice(SEARCH_WORDS) for _ in range(3)).capitalize(),
+                "category": rng.choice(categories),
+                "details": " ".join(rng.choice(SEARCH_WORDS) for _ in range(20)),
+                "amount": rng.randint(0, 20), "price": rng.randint(500, 50000), "discount": 0,
+                "img_path": "/bench/search.jpg", "created_at": now,
+            } for _ in range(min(10000, missing - start))])
+            db.session.commit()
+
+        client = app.test_client()
+        latencies = []
+        for _ in range(queries):
+            words = rng.sample(SEARCH_WORDS, rng.randint(1, 2))
+            q = " ".join(word[:rng.randint(3, len(word))] for word in words)
+            category = f"&category={rng.choice(categories).value}" if rng.random() < 0.3 else ""
+            start = time.perf_counter()
+            client.get(f"/products/search?q={q}{category}&page={rng.randint(1, 3)}")
+            latencies.append(time.perf_counter() - start)
+        print(f"{queries} searches: {percentiles(latencies)} ms")
+
+        if missing and not keep:
+            db.session.execute(db.delete(Product).where(Product.img_path == "/bench/search.jpg"))
+            db.session.commit()
+
+    @app.cli.command("bench-endpoints")
+    @click.option("--mode", type=click.Choice(["client", "gunicorn"]), default="client",
+                  help="In-process test client or a real gunicorn worker over HTTP")
+    @click.option("--requests", default=200, help="Requests per endpoint")
+    @click.option("--concurrency", default=1, help="Concurrent clients")
+    @click.option("--workers", default=1, help="Gunicorn workers (gunicorn mode)")
+    @click.option("--output", default="bench-report.json", help="Where to write the JSON report")
+    @click.option("--baseline", default=None, help="Baseline report to compare against")
+    @click.option("--margin", default=0.2, help="Allowed regression over the baseline (0.2 = 20%)")
+    @click.option("--noise-ms", default=1.0, help="Latency increase always tolerated, in ms")
+    @click.option("--update-baseline", is_flag=True, help="Write this run as the new baseline")
+    def bench_endpoints(mode, requests, concurrency, workers, output, baseline, margin, noise_ms, update_baseline):
+        """
+        Throughput, p50/p95/p99 y consultas por peticion de los endpoints principales
+        (catalogo, producto, carrito, favoritos y login) sobre los datos de insert-test-data.
+        Con --baseline termina con error si alguna metrica empeora mas de --margin.
+        """
+        from api.benchmarks import load_sample, run_benchmarks, compare, build_report, ClientDriver, GunicornDriver
+        sample = load_sample()
+        driver = ClientDriver(app) if mode == "client" else GunicornDriver(workers=workers, threads=concurrency)
+        with driver:
+            endpoints = run_benchmarks(driver, sample, requests=requests, concurrency=concurrency)
+        report = build_report(mode, endpoints)
+
+        for name, result in endpoints.items():
+            print(f"{name:28} {result['rps']:>8} req/s  p50 {result['p50']:>7} ms  p95 {result['p95']:>7} ms  "
+                  f"p99 {result['p99']:>7} ms  queries {result['queries_per_request']}  errors {result['errors']}")
+        with open(output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {output}")
+
+        if baseline and update_baseline:
+            with open(baseline, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Baseline updated: {baseline}")
+        elif baseline:
+            if not os.path.exists(baseline):
+                raise click.ClickException(f"Baseline {baseline} not found, run with --update-baseline first")
+            with open(baseline) as f:
+                previous = json.load(f)
+            if previous.get("mode") != mode:
+                raise click.ClickException(f"Baseline was recorded in {previous.get('mode')} mode, not {mode}")
+            regressions = compare(report, previous, margin, noise_ms)
+            if regressions:
+                for regression in regressions:
+                    print(f"REGRESSION {regression}")
+                raise SystemExit(1)
+            print(f"OK: no regressions over {baseline} (margin {margin:.0%})")
+
+    @app.cli.command("stripe-stub")
+    @click.option("--port", default=12111, help="Port to listen on")
+    @click.option("--latency", default=300, help="Mean latency in ms")
+    @click.option("--jitter", default=200, help="Latency jitter in ms")
+    @click.option("--error-rate", default=0.0, help="Fraction of retryable 500 responses")
+    def stripe_stub(port, latency, jitter, error_rate):
+        """
+        Stub local de Stripe. Arrancar la API con STRIPE_API_BASE=http://127.0.0.1:<port>
+        y STRIPE_API_KEY=sk_test_stub para probar el checkout sin red.
+        """
+        from api.stripe_stub import make_server
+        server = make_server(port=port, latency=latency / 1000, jitter=jitter / 1000, error_rate=error_rate)
+        print(f"Stripe stub listening on http://127.0.0.1:{port}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+    @app.cli.command("bench-checkout")
+    @click.option("--requests", default=200, help="Checkout requests to send")
+    @click.option("--concurrency", default=8, help="Concurrent clients")
+    @click.option("--carts", default=20, help="Distinct carts (retries of the same cart must reuse its session)")
+    @click.option("--latency", default=300, help="Stub mean latency in ms")
+    @click.option("--jitter", default=200, help="Stub latency jitter in ms")
+    @click.option("--error-rate", default=0.05, help="Stub fraction of retryable 500 responses")
+    def bench_checkout(requests, concurrency, carts, latency, jitter, error_rate):
+        """
+        Carga sobre POST /create-checkout-session contra el stub de Stripe, sin red.
+        Comprueba que cada carrito obtiene una unica sesion aunque se repita el POST.
+        Crea sus propios usuarios con un carrito cada uno y los borra al terminar.
+        """
+        from flask_jwt_extended import create_access_token
+        from api import payments
+        from api.identity import identity_claims
+        from api.reservations import release
+        from api.stripe_stub import make_server
+        suffix = time.time_ns()
+        users = [User(firstname="Checkout", lastname=f"Bench {cart}", email=f"checkout_{suffix}_{cart}@test.com",
+                      password="123456", rol=RoleEnum.COSTUMER, is_active=True)
+                 for cart in range(carts)]
+        db.session.add_all(users)
+        db.session.flush()
+        product = Product(artist_id=users[0].id, name=f"Checkout SKU {suffix}", category=CategoryEnum.LAMPS,
+                          details="Checkout benchmark", amount=carts, price=100, discount=0,
+                          img_path="/stress.jpg")
+        orders = [Order() for _ in range(carts)]
+        db.session.add(product)
+        db.session.add_all(orders)
+        db.session.flush()
+        db.session.execute(db.insert(user_order), [
+            {"user_id": user.id, "order_id": order.id} for user, order in zip(users, orders)])
+        db.session.execute(db.insert(prod_order), [
+            {"prod_id": product.id, "order_id": order.id} for order in orders])
+        db.session.add_all([OrderItem(order_id=order.id, prod_id=product.id, quantity=1) for order in orders])
+        db.session.commit()
+        user_ids, order_ids, prod_id = [user.id for user in users], [order.id for order in orders], product.id
+
+        # El checkout toma el usuario del JWT
+        headers = []
+        for user in users:
+            token = create_access_token(identity=str(user.id), additional_claims=identity_claims(user))
+            headers.append({"Authorization": f"Bearer {token}"})
+
+        server = make_server(port=0, latency=latency / 1000, jitter=jitter / 1000, error_rate=error_rate)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        os.environ["STRIPE_API_BASE"] = f"http://127.0.0.1:{server.server_port}"
+        os.environ.setdefault("STRIPE_API_KEY", "sk_test_stub")
+        payments.reset_client()
+
+        def checkout_loop(offset):
+            client = app.test_client()
+            latencies, urls, failures, pending = [], {}, 0, 0
+            for i in range(offset, requests, concurrency):
+                cart = i % carts
+                body = {"items": [{"name": f"Product {cart}", "unit_amount": 1000 + cart, "quantity": 1}]}
+                start = time.perf_counter()
+                response = client.post("/create-checkout-session", json=body, headers=headers[cart])
+                while response.status_code == 202:
+                    pending += 1
+                    time.sleep(float(response.headers.get("Retry-After", 1)) / 10)
+                    response = client.post("/create-checkout-session", json=body, headers=headers[cart])
+                latencies.append(time.perf_counter() - start)
+                if response.status_code == 200:
+                    urls.setdefault(cart, set()).add(response.get_json()["url"])
+                else:
+                    failures += 1
+            return latencies, urls, failures, pending
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(checkout_loop, range(concurrency)))
+        elapsed = time.perf_counter() - started
+        server.shutdown()
+
+        latencies = [latency for result in results for latency in result[0]]
+        sessions = {}
+        for result in results:
+            for cart, urls in result[1].items():
+                sessions.setdefault(cart, set()).update(urls)
+        duplicated = sum(1 for urls in sessions.values() if len(urls) > 1)
+        print(f"{len(latencies)} checkouts in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} req/s), "
+              f"execution mode: {payments.STRIPE_EXECUTION}")
+        print(f"latency: {percentiles(latencies)} ms")
+        print(f"failed: {sum(result[2] for result in results)}, 202 pending responses: {sum(result[3] for result in results)}")
+        print(f"stub: {server.state.requests} requests, {server.state.errors} injected errors, "
+              f"{len(server.state.sessions)} sessions created for {len(sessions)} carts")
+        print("OK: one session per cart" if not duplicated else f"FAIL: {duplicated} carts got several sessions")
+
+        # Los checkouts han retenido el stock de estos carritos
+        for order_id in order_ids:
+            release(order_id)
+        db.session.execute(db.delete(OrderItem).where(OrderItem.order_id.in_(order_ids)))
+        db.session.execute(db.delete(prod_order).where(prod_order.c.order_id.in_(order_ids)))
+        db.session.execute(db.delete(user_order).where(user_order.c.order_id.in_(order_ids)))
+        db.session.execute(db.delete(Order).where(Order.id.in_(order_ids)))
+        db.session.execute(db.delete(Product).where(Product.id == prod_id))
+        db.session.execute(db.delete(User).where(User.id.in_(user_ids)))
+        db.session.commit()
+        if duplicated:
+            raise SystemExit(1)
+
+    @app.cli.command("sweep-reservations")
+    def sweep_reservations():
+        """
+        Libera las reservas de stock caducadas. Se programa cada minuto (cron, Heroku Scheduler):
+        $ pipenv run sweep-reservations
+        """
+        from api.reservations import sweep_expired
+        print(f"Released {sweep_expired()} reserved units")
+
+    @app.cli.command("bench-reservations")
+    @click.option("--threads", default=16, help="Concurrent buyers")
+    @click.option("--attempts", default=100, help="Checkout attempts per buyer")
+    @click.option("--stock", default=200, help="Units in stock of the hot product")
+    @click.option("--quantity", default=1, help="Units per checkout")
+    @click.option("--pay-rate", default=0.5, help="Fraction of holds that get paid")
+    @click.option("--abandon-rate", default=0.3, help="Fraction of holds released at once (the rest expire)")
+    @click.option("--ttl", default=0.5, help="Hold lifetime in seconds")
+    def bench_reservations(threads, attempts, stock, quantity, pay_rate, abandon_rate, ttl):
+        """
+        Varios hilos compran el mismo producto: reservan, pagan, abandonan o dejan caducar
+        la reserva mientras otro hilo barre las caducadas. Comprueba que nunca se vende
+        ni se retiene mas stock del que hay y mide las reservas por segundo.
+        Borra sus datos al terminar.
+        """
+        from api.reservations import reserve, release, confirm, sweep_expired, OutOfStock
+        suffix = time.time_ns()
+        user = User(firstname="Stress", lastname="Test", email=f"reservations_{suffix}@test.com",
+                    password="123456", rol=RoleEnum.COSTUMER, is_active=True)
+        db.session.add(user)
+        db.session.flush()
+        product = Product(artist_id=user.id, name=f"Hot SKU {suffix}", category=CategoryEnum.LAMPS,
+                          details="Contended product", amount=stock, price=100, discount=0,
+                          img_path="/stress.jpg")
+        db.session.add(product)
+        orders = [Order() for _ in range(threads * attempts)]
+        db.session.add_all(orders)
+        db.session.commit()
+        user_id, prod_id = user.id, product.id
+        order_ids = [order.id for order in orders]
+
+        def buyer_loop(offset):
+            rng = random.Random(offset)
+            latencies, counts = [], {"held": 0, "sold_out": 0, "paid": 0, "errors": 0}
+            with app.app_context():
+                for order_id in order_ids[offset::threads]:
+                    start = time.perf_counter()
+                    try:
+                        reserve(order_id, {prod_id: quantity}, ttl=ttl)
+                        db.session.commit()
+                        counts["held"] += 1
+                    except OutOfStock:
+                        db.session.rollback()
+                        counts["sold_out"] += 1
+                        continue
+                    except Exception:
+                        db.session.rollback()
+                        counts["errors"] += 1
+                        continue
+                    finally:
+                        latencies.append(time.perf_counter() - start)
+
+                    outcome = rng.random()
+                    try:
+                        if outcome < pay_rate:
+                            # Si la reserva ya caduco, confirm() no vende nada
+                            counts["paid"] += confirm(order_id).get(prod_id, 0)
+                        elif outcome < pay_rate + abandon_rate:
+                            release(order_id)
+                        db.session.commit()
+                    except Exception:
+                        db.session.rollback()
+                        counts["errors"] += 1
+            return latencies, counts
+
+        stop = threading.Event()
+        violations = []
+
+        def sweeper():
+            with app.app_context():
+                while not stop.wait(ttl / 4):
+                    try:
+                        sweep_expired()
+                        amount, reserved = db.session.execute(
+                            db.select(Product.amount, Product.reserved).where(Product.id == prod_id)).one()
+                        db.session.commit()
+                        if amount < 0 or reserved < 0 or reserved > amount:
+                            violations.append((amount, reserved))
+                    except Exception:
+                        db.session.rollback()
+
+        sweep_thread = threading.Thread(target=sweeper, daemon=True)
+        sweep_thread.start()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            results = list(pool.map(buyer_loop, range(threads)))
+        elapsed = time.perf_counter() - started
+        stop.set()
+        sweep_thread.join()
+
+        # Lo que quede retenido se libera como si hubiera caducado
+        sweep_expired(now=datetime.now(timezone.utc) + timedelta(seconds=ttl + 1))
+        amount, reserved = db.session.execute(
+            db.select(Product.amount, Product.reserved).where(Product.id == prod_id)).one()
+        latencies = [latency for result in results for latency in result[0]]
+        counts = {key: sum(result[1][key] for result in results) for key in results[0][1]}
+
+        print(f"{len(latencies)} reservation attempts on one product in {elapsed:.2f}s "
+              f"({len(latencies) / elapsed:.0f} attempts/s, {threads} threads)")
+        print(f"reserve latency: {percentiles(latencies)} ms")
+        print(f"held: {counts['held']}, sold out: {counts['sold_out']}, errors: {counts['errors']}, "
+              f"units paid: {counts['paid']}")
+        print(f"stock: {stock} -> {amount} left, {reserved} still reserved")
+        oversold = counts["paid"] > stock or amount != stock - counts["paid"] or reserved != 0 or violations
+        print("OK: no overselling" if not oversold else f"FAIL: stock accounting broken {violations[:5]}")
+
+        db.session.execute(db.delete(Reservation).where(Reservation.prod_id == prod_id))
+        db.session.execute(db.delete(Order).where(Order.id.in_(order_ids)))
+        db.session.execute(db.delete(Product).where(Product.id == prod_id))
+        db.session.execute(db.delete(User).where(User.id == user_id))
+        db.session.commit()
+        if oversold:
+            raise SystemExit(1)
@@ -0,0 +1,194 @@
+"""
+Generador de datos sinteticos para pruebas de carga (flask insert-test-data).
+Con la misma semilla genera siempre el mismo dataset. Los ids se asignan a partir
+del maximo actual de cada tabla, asi los enlaces se construyen sin leer nada de vuelta.
+En Postgres las filas se cargan con COPY; en el resto con INSERT executemany por bloques.
+"""
+import csv
+import enum
+import io
+import random
+from datetime import datetime, timedelta, timezone
+from itertools import accumulate, islice
+from sqlalchemy import func, text
+from .models import (db, User, Product, Order, OrderItem, Favorite, RoleEnum, CategoryEnum,
+                     user_order, prod_order, user_fav, prod_fav)
+
+FIRST_NAMES = ["Juan", "Maria", "Lucia", "Pablo", "Ana", "Carlos", "Sofia", "Diego", "Elena",
+               "Javier", "Laura", "Miguel", "Paula", "Andres", "Carmen", "Jorge", "Marta", "Raul"]
+LAST_NAMES = ["Perez", "Garcia", "Lopez", "Martinez", "Sanchez", "Gomez", "Fernandez", "Ruiz",
+              "Diaz", "Moreno", "Alvarez", "Romero", "Navarro", "Torres", "Dominguez", "Vazquez"]
+MATERIALS = ["Wooden", "Bronze", "Marble", "Resin", "Ceramic", "Glass", "Iron", "Clay", "Stone"]
+SUBJECTS = {
+    CategoryEnum.LAMPS: ["Lamp", "Table Lamp", "Pendant Lamp", "Floor Lamp", "Night Light"],
+    CategoryEnum.SCULPTURES: ["Sculpture", "Bust", "Relief", "Abstract Form", "Figure"],
+    CategoryEnum.STATUES: ["Statue", "Figurine", "Diorama", "Miniature", "Idol"],
+}
+STYLES = ["handmade", "modern", "classic", "minimalist", "rustic", "vintage", "baroque", "nordic"]
+
+SEQUENCE_TABLES = [User, Product, Order, OrderItem, Favorite]
+
+# Fechas de creacion relativas a un instante fijo (no a la hora actual): misma semilla, mismas filas
+REFERENCE_TIME = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+class Writer:
+    """
+    Escribe filas (tuplas) en una tabla por bloques de `chunk_size` y hace commit
+    despues de cada bloque, para no acumular una transaccion enorme.
+    """
+
+    def __init__(self, chunk_size):
+        self.chunk_size = chunk_size
+        self.use_copy = db.engine.dialect.name == "postgresql"
+        self.counts = {}
+
+    def write(self, table, columns, rows):
+        rows = iter(rows)
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            if not chunk:
+                break
+            if self.use_copy:
+                self._copy(table, columns, chunk)
+            else:
+                db.session.execute(table.insert(), [dict(zip(columns, row)) for row in chunk])
+            db.session.commit()
+            self.counts[table.name] = self.counts.get(table.name, 0) + len(chunk)
+
+    def _copy(self, table, columns, chunk):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in chunk:
+            writer.writerow([_copy_value(value) for value in row])
+        buffer.seek(0)
+        preparer = db.engine.dialect.identifier_preparer
+        names = ", ".join(preparer.quote(column) for column in columns)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert(f"COPY {preparer.format_table(table)} ({names}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+
+def _copy_value(value):
+    # Los Enum se guardan por nombre (como hace SQLAlchemy) y NULL es el campo vacio
+    if isinstance(value, enum.Enum):
+        return value.name
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return "" if value is None else value
+
+
+def _next_id(model):
+    return (db.session.execute(db.select(func.max(model.id))).scalar() or 0) + 1
+
+
+def _reset_sequences():
+    # Tras insertar ids explicitos, las secuencias de Postgres deben continuar desde el maximo
+    if db.engine.dialect.name != "postgresql":
+        return
+    for model in SEQUENCE_TABLES:
+        name = db.engine.dialect.identifier_preparer.format_table(model.__table__)
+        db.session.execute(text(
+            f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), "
+            f"COALESCE((SELECT MAX(id) FROM {name}), 0) + 1, false)"))
+    db.session.commit()
+
+
+def generate_dataset(users=10000, artists=200, products=20000, carts=5000, favorites=50000,
+                     seed=42, chunk_size=10000, log=print):
+    """
+    Inserta un dataset reproducible: clientes y artistas, productos de todas las categorias,
+    carritos (Order + OrderItem + enlaces) y favoritos. La popularidad de los productos
+    sigue una ley de potencias, asi unos pocos productos acumulan la mayoria de carritos y favoritos.
+    Devuelve el numero de filas insertadas por tabla.
+    """
+    rng = random.Random(seed)
+    writer = Writer(chunk_size)
+    now = REFERENCE_TIME
+    categories = list(CategoryEnum)
+
+    first_user = _next_id(User)
+    first_artist = first_user + users
+    customer_ids = range(first_user, first_user + users)
+    artist_ids = range(first_artist, first_artist + artists)
+
+    def user_rows():
+        for user_id in range(first_user, first_artist + artists):
+            rol = RoleEnum.ARTIST if user_id >= first_artist else RoleEnum.COSTUMER
+            yield (user_id, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+                   f"user{user_id}@test.com", "123456", rol, rng.random() > 0.02,
+                   now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)))
+
+    log(f"Inserting {users} customers and {artists} artists")
+    writer.write(User.__table__, ["id", "firstname", "lastname", "email", "password", "rol",
+                                  "is_active", "created_at"], user_rows())
+
+    first_product = _next_id(Product)
+    product_ids = list(range(first_product, first_product + products))
+
+    def product_rows():
+        for product_id in product_ids:
+            category = rng.choice(categories)
+            name = f"{rng.choice(MATERIALS)} {rng.choice(SUBJECTS[category])} {product_id}"
+            details = (f"{rng.choice(STYLES).capitalize()} {name.lower()} by a local artist. "
+                       f"{' '.join(rng.sample(STYLES, 3))} piece, {rng.randint(5, 80)}cm.")
+            yield (product_id, rng.choice(artist_ids), name, category, details,
+                   rng.choice([0, 1, 2, 5, 10, 20, 50]), rng.randint(500, 50000),
+                   rng.choice([0, 0, 0, 5, 10, 20]), f"/img/products/{product_id % 50}.jpg",
+                   now - timedelta(seconds=rng.randint(0, 365 * 24 * 3600)))
+
+    log(f"Inserting {products} products")
+    writer.write(Product.__table__, ["id", "artist_id", "name", "category", "details", "amount",
+                                     "price", "discount", "img_path", "created_at"], product_rows())
+
+    # Popularidad sesgada: el producto en la posicion i tiene peso 1 / (i + 1) ^ 1.1
+    popularity = product_ids[:]
+    rng.shuffle(popularity)
+    cum_weights = list(accumulate(1 / (rank + 1) ** 1.1 for rank in range(len(popularity))))
+
+    def popular_products(count):
+        picked = set(rng.choices(popularity, cum_weights=cum_weights, k=count))
+        return sorted(picked)
+
+    carts = min(carts, users)
+    first_order = _next_id(Order)
+    first_item = _next_id(OrderItem)
+    cart_users = rng.sample(customer_ids, carts)
+    cart_lines = [popular_products(rng.randint(1, 8)) for _ in range(carts)] if products else [[]] * carts
+
+    log(f"Inserting {carts} carts")
+    writer.write(Order.__table__, ["id"], ((first_order + index,) for index in range(carts)))
+    writer.write(user_order, ["user_id", "order_id"],
+                 ((user_id, first_order + index) for index, user_id in enumerate(cart_users)))
+    writer.write(prod_order, ["prod_id", "order_id"],
+                 ((prod_id, first_order + index) for index, lines in enumerate(cart_lines) for prod_id in lines))
+
+    def item_rows():
+        item_id = first_item
+        for index, lines in enumerate(cart_lines):
+            for prod_id in lines:
+                yield item_id, first_order + index, prod_id, rng.randint(1, 3)
+                item_id += 1
+
+    writer.write(OrderItem.__table__, ["id", "order_id", "prod_id", "quantity"], item_rows())
+
+    # Cada Favorite enlaza un usuario con un producto, igual que hace POST /my-favorites
+    favorite_pairs = set()
+    if products and users:
+        while len(favorite_pairs) < min(favorites, users * products):
+            user_id = rng.choice(customer_ids)
+            for prod_id in popular_products(rng.randint(1, 10)):
+                favorite_pairs.add((user_id, prod_id))
+    favorite_pairs = sorted(favorite_pairs)[:favorites]
+    first_fav = _next_id(Favorite)
+
+    log(f"Inserting {len(favorite_pairs)} favorites")
+    writer.write(Favorite.__table__, ["id"], ((first_fav + index,) for index in range(len(favorite_pairs))))
+    writer.write(user_fav, ["user_id", "fav_id"],
+                 ((user_id, first_fav + index) for index, (user_id, _) in enumerate(favorite_pairs)))
+    writer.write(prod_fav, ["prod_id", "fav_id"],
+                 ((prod_id, first_fav + index) for index, (_, prod_id) in enumerate(favorite_pairs)))
+
+    _reset_sequences()
+    return writer.counts
@@ -0,0 +1,98 @@
+"""
+Usuario actual de las peticiones con JWT: current_identity().
+No se registra user_lookup_loader (flask_jwt_extended lo ejecutaria en cada @jwt_required):
+el usuario se resuelve solo en los endpoints que lo piden, una vez por peticion, contra
+identity_cache (LRU con TTL) y solo va a la base de datos en un fallo de cache. El valor cacheado es el dict de User.serialize(),
+no un objeto del ORM, asi se puede compartir entre sesiones e hilos.
+Al hacer commit de un cambio en un User (actualizacion o borrado, tambien desde el admin)
+se sube identity_version y se descartan todas las identidades cacheadas; para cambios
+con UPDATE masivos hay que llamar a invalidate_identities().
+Los tokens llevan ademas los claims rol e is_active para comprobaciones sin cargar el usuario.
+"""
+from flask import g, jsonify
+from flask_jwt_extended import get_jwt, get_jwt_header
+from flask_jwt_extended.exceptions import UserLookupError
+from sqlalchemy import event
+from sqlalchemy.orm import object_session
+from .cache import identity_cache, identity_version
+from .models import db, User
+from .replicas import RoutingSession
+from .serializers import user_serializer
+
+_CHANGED = "identity_changed"
+
+
+def _user_id(subject):
+    try:
+        return int(subject)
+    except (TypeError, ValueError):
+        return None
+
+
+def identity_claims(user):
+    # Claims extra del access token (create_access_token(additional_claims=...))
+    return {"rol": user.rol.value, "is_active": user.is_active}
+
+
+def load_identity(user_id):
+    key = (identity_version.current(), user_id)
+    identity = identity_cache.get(key)
+    if identity is None:
+        row = db.session.execute(user_serializer.select().where(User.id == user_id)).first()
+        if row is None:
+            return None
+        identity = user_serializer.to_dict(row)
+        identity_cache.set(key, identity)
+    return identity
+
+
+def invalidate_identities():
+    identity_version.bump()
+
+
+def current_identity():
+    """
+    Usuario (dict) del token de la peticion actual; llamar despues de @jwt_required.
+    Si no existe o esta inactivo se lanza UserLookupError y responde _user_lookup_error.
+    """
+    if "identity" not in g:
+        jwt_data = get_jwt()
+        user_id = _user_id(jwt_data["sub"])
+        identity = load_identity(user_id) if user_id is not None else None
+        if identity is None or not identity["is_active"]:
+            raise UserLookupError("Could not load user", get_jwt_header(), jwt_data)
+        g.identity = identity
+    return g.identity
+
+
+def _user_lookup_error(jwt_header, jwt_data):
+    user_id = _user_id(jwt_data["sub"])
+    if user_id is None:
+        return jsonify({"msg": "Invalid token identity"}), 422
+    if load_identity(user_id) is not None:
+        return jsonify({"msg": "User is inactive"}), 403
+    return jsonify({"msg": "User not found"}), 404
+
+
+def _user_changed(mapper, connection, target):
+    session = object_session(target)
+    if session is not None:
+        session.info[_CHANGED] = True
+
+
+def _after_commit(session):
+    # Despues del commit: invalidar antes podria volver a cachear el usuario sin el cambio
+    if session.info.pop(_CHANGED, False):
+        invalidate_identities()
+
+
+def _after_rollback(session):
+    session.info.pop(_CHANGED, None)
+
+
+def setup_identity(jwt):
+    jwt.user_lookup_error_loader(_user_lookup_error)
+    event.listen(User, "after_update", _user_changed)
+    event.listen(User, "after_delete", _user_changed)
+    event.listen(RoutingSession, "after_commit", _after_commit)
+    event.listen(RoutingSession, "after_rollback", _after_rollback)
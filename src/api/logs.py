@@ -0,0 +1,139 @@
+"""
+Logging estructurado (una linea JSON por registro) sin I/O en el hilo de la peticion:
+los registros se encolan con un QueueHandler y un hilo en segundo plano (QueueListener)
+los formatea y los escribe en stderr. Cada registro lleva el id de la peticion
+(cabecera X-Request-ID, que tambien se devuelve en la respuesta).
+Los cuerpos y listados se registran con log_payload(): muestreados y truncados.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import reprlib
+import sys
+import uuid
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from flask import request, request_started, request_finished, request_tearing_down
+
+logger = logging.getLogger("api")
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", 10000))
+PAYLOAD_SAMPLE_RATE = float(os.getenv(
+    "LOG_PAYLOAD_SAMPLE_RATE", "1" if os.getenv("FLASK_DEBUG") == "1" else "0.01"))
+PAYLOAD_MAX_CHARS = int(os.getenv("LOG_PAYLOAD_MAX_CHARS", 1000))
+
+REQUEST_ID_HEADER = "X-Request-ID"
+_VALID_REQUEST_ID = re.compile(r"^[\w.\-]{1,64}$")
+
+_request_id = ContextVar("request_id", default=None)
+
+# repr acotado: no recorre mas de unos pocos elementos por nivel, cueste lo que cueste el objeto
+_repr = reprlib.Repr()
+_repr.maxlevel = 3
+_repr.maxlist = _repr.maxtuple = _repr.maxset = _repr.maxdict = 10
+_repr.maxstring = _repr.maxother = 200
+
+
+def current_request_id():
+    return _request_id.get()
+
+
+def truncate(payload):
+    text = _repr.repr(payload)
+    if len(text) > PAYLOAD_MAX_CHARS:
+        return f"{text[:PAYLOAD_MAX_CHARS]}... ({len(text)} chars)"
+    return text
+
+
+def log_payload(message, payload, level=logging.INFO):
+    """
+    Registra `payload` (cuerpo de una peticion, filas de un listado...) en una de cada
+    1 / LOG_PAYLOAD_SAMPLE_RATE llamadas. Si no toca, el coste es una comparacion.
+    """
+    if random.random() >= PAYLOAD_SAMPLE_RATE or not logger.isEnabledFor(level):
+        return
+    logger.log(level, "%s: %s", message, truncate(payload))
+
+
+class RequestIdFilter(logging.Filter):
+    # Se ejecuta en el hilo que registra, asi el id es el de su peticion
+    def filter(self, record):
+        record.request_id = _request_id.get()
+        return True
+
+
+class AsyncQueueHandler(QueueHandler):
+    """
+    QueueHandler que no formatea en el hilo de la peticion (lo hace el listener)
+    y que descarta registros si la cola esta llena en lugar de bloquear.
+    """
+    dropped = 0
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            AsyncQueueHandler.dropped += 1
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", None),
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+def _request_started(sender, **extra):
+    incoming = request.headers.get(REQUEST_ID_HEADER, "")
+    _request_id.set(incoming if _VALID_REQUEST_ID.match(incoming) else uuid.uuid4().hex)
+
+
+def _request_finished(sender, response, **extra):
+    request_id = _request_id.get()
+    if request_id is not None:
+        response.headers[REQUEST_ID_HEADER] = request_id
+
+
+def _request_tearing_down(sender, **extra):
+    _request_id.set(None)
+
+
+def setup_logging(app):
+    """
+    Conecta el logger raiz a la cola. El hilo del listener se arranca en cada worker
+    (la app se importa despues del fork de gunicorn) y se vacia al salir.
+    """
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    handler = AsyncQueueHandler(log_queue)
+    handler.addFilter(RequestIdFilter())
+
+    output = logging.StreamHandler(sys.stderr)
+    output.setFormatter(JSONFormatter())
+    listener = QueueListener(log_queue, output, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    root = logging.getLogger()
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(handler)
+
+    request_started.connect(_request_started, app)
+    request_finished.connect(_request_finished, app)
+    request_tearing_down.connect(_request_tearing_down, app)
+    return listener
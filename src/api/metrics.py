@@ -0,0 +1,132 @@
+"""
+Metricas en formato Prometheus para GET /metrics: peticiones y latencia por ruta,
+peticiones en curso, conexiones del pool de SQLAlchemy, hits/misses de las caches
+y latencia de las llamadas a Stripe.
+Con gunicorn (src/gunicorn.conf.py) cada worker escribe sus metricas en
+PROMETHEUS_MULTIPROC_DIR y /metrics las suma, asi un scrape ve la instancia entera.
+"""
+import os
+import time
+from contextlib import contextmanager
+from flask import g, request, request_started, request_finished, request_tearing_down
+from prometheus_client import (CollectorRegistry, Counter, Gauge, Histogram, REGISTRY,
+                               CONTENT_TYPE_LATEST, generate_latest, multiprocess)
+from prometheus_client.core import GaugeMetricFamily
+from sqlalchemy import event
+
+MULTIPROCESS = bool(os.getenv("PROMETHEUS_MULTIPROC_DIR"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.075, 0.1, 0.25, 0.5, 0.75, 1.0, 2.5, 5.0, 10.0)
+
+REQUESTS = Counter(
+    "http_requests_total", "HTTP requests by route and status", ["method", "route", "status"])
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ["method", "route"],
+    buckets=LATENCY_BUCKETS)
+IN_PROGRESS = Gauge(
+    "http_requests_in_progress", "HTTP requests being served", multiprocess_mode="livesum")
+POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out", "SQLAlchemy connections checked out", ["pool"], multiprocess_mode="livesum")
+POOL_OVERFLOW = Gauge(
+    "db_pool_overflow", "SQLAlchemy connections over pool_size", ["pool"], multiprocess_mode="livesum")
+CACHE_LOOKUPS = Counter(
+    "cache_lookups_total", "In-memory cache lookups", ["cache", "result"])
+STRIPE_LATENCY = Histogram(
+    "stripe_request_duration_seconds", "Stripe API call latency", ["operation", "outcome"],
+    buckets=LATENCY_BUCKETS)
+
+
+class CacheHitRatioCollector:
+    # cache_hit_ratio{cache} calculado en cada scrape a partir de cache_lookups_total ya agregado
+
+    def __init__(self, source):
+        self.source = source
+
+    def collect(self):
+        lookups = {}
+        for metric in self.source.collect():
+            if metric.name != "cache_lookups":
+                continue
+            for sample in metric.samples:
+                if sample.name == "cache_lookups_total":
+                    counts = lookups.setdefault(sample.labels["cache"], {"hit": 0.0, "miss": 0.0})
+                    counts[sample.labels["result"]] += sample.value
+        ratio = GaugeMetricFamily("cache_hit_ratio", "Cache hits / lookups since start", labels=["cache"])
+        for cache, counts in sorted(lookups.items()):
+            total = counts["hit"] + counts["miss"]
+            ratio.add_metric([cache], counts["hit"] / total if total else 0.0)
+        yield ratio
+
+
+def render():
+    # Devuelve (cuerpo, content type) con las metricas de todos los workers
+    if MULTIPROCESS:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    ratios = CollectorRegistry()
+    ratios.register(CacheHitRatioCollector(registry))
+    return generate_latest(registry) + generate_latest(ratios), CONTENT_TYPE_LATEST
+
+
+@contextmanager
+def observe_stripe(operation):
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        STRIPE_LATENCY.labels(operation, outcome).observe(time.perf_counter() - start)
+
+
+def watch_cache(name, cache):
+    hit = CACHE_LOOKUPS.labels(name, "hit")
+    miss = CACHE_LOOKUPS.labels(name, "miss")
+    cache.on_lookup = lambda found: (hit if found else miss).inc()
+
+
+def watch_pool(name, engine):
+    # checkin se dispara antes de devolver la conexion al pool: se cuenta con inc/dec
+    pool = engine.pool
+    checked_out = POOL_CHECKED_OUT.labels(name)
+    overflow = POOL_OVERFLOW.labels(name)
+
+    def on_checkout(*args):
+        checked_out.inc()
+        if hasattr(pool, "overflow"):
+            overflow.set(max(0, pool.overflow()))
+
+    def on_checkin(*args):
+        checked_out.dec()
+
+    event.listen(pool, "checkout", on_checkout)
+    event.listen(pool, "checkin", on_checkin)
+
+
+def _request_started(sender, **extra):
+    g._metrics_started = time.perf_counter()
+    IN_PROGRESS.inc()
+
+
+def _request_finished(sender, response, **extra):
+    started = g.get("_metrics_started")
+    if started is None or g.get("_metrics_recorded"):
+        return
+    g._metrics_recorded = True
+    route = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    REQUESTS.labels(request.method, route, str(response.status_code)).inc()
+    REQUEST_LATENCY.labels(request.method, route).observe(time.perf_counter() - started)
+
+
+def _request_tearing_down(sender, **extra):
+    # Se ejecuta siempre, tambien cuando la peticion termina con una excepcion sin manejar
+    if g.pop("_metrics_started", None) is not None:
+        IN_PROGRESS.dec()
+
+
+def setup_metrics(app):
+    request_started.connect(_request_started, app)
+    request_finished.connect(_request_finished, app)
+    request_tearing_down.connect(_request_tearing_down, app)
@@ -1,37 +1,58 @@
 from flask_sqlalchemy import SQLAlchemy
-from sqlalchemy import String, Boolean, Integer, Enum, DateTime, ForeignKey, Table, Column
+from sqlalchemy import String, Boolean, Integer, Enum, DateTime, ForeignKey, Table, Column, Index, UniqueConstraint, text
 from sqlalchemy.orm import Mapped, mapped_column, relationship
+from sqlalchemy.dialects import postgresql, sqlite
 from datetime import datetime, timezone
 import enum
+from .timing import timed
+from .replicas import RoutingSession
+
+# RoutingSession envia las lecturas de los endpoints @read_replica a las replicas (api/replicas.py)
+db = SQLAlchemy(session_options={"class_": RoutingSession})
+
+
+def dialect_insert(table):
+    # INSERT con soporte de ON CONFLICT del motor en uso (Postgres en produccion, SQLite en local)
+    if db.engine.dialect.name == "postgresql":
+        return postgresql.insert(table)
+    return sqlite.insert(table)
 
-db = SQLAlchemy()
 
 user_order = Table(
     "user_order",
     db.metadata,
-    Column("user_id", ForeignKey("user.id")),
-    Column("order_id", ForeignKey("order.id")),
+    Column("user_id", ForeignKey("user.id"), primary_key=True),
+    Column("order_id", ForeignKey("order.id"), primary_key=True),
+    # False cuando el pedido se ha pagado: el enlace se conserva como historico del usuario
+    Column("is_open", Boolean, nullable=False, server_default=text("true")),
+    Index("ix_user_order_order_id", "order_id"),
+    # Cada usuario tiene un unico pedido abierto (su carrito); los pagados no cuentan
+    Index("uq_user_order_user_id", "user_id", unique=True,
+          postgresql_where=text("is_open"), sqlite_where=text("is_open")),
 )
 
 prod_order = Table(
     "prod_order",
     db.metadata,
-    Column("prod_id", ForeignKey("product.id")),
-    Column("order_id", ForeignKey("order.id")),
+    Column("prod_id", ForeignKey("product.id"), primary_key=True),
+    Column("order_id", ForeignKey("order.id"), primary_key=True),
+    Index("ix_prod_order_order_id", "order_id"),
 )
 
 user_fav = Table(
     "user_fav",
     db.metadata,
-    Column("user_id", ForeignKey("user.id")),
-    Column("fav_id", ForeignKey("favorite.id")),
+    Column("user_id", ForeignKey("user.id"), primary_key=True),
+    Column("fav_id", ForeignKey("favorite.id"), primary_key=True),
+    Index("ix_user_fav_fav_id", "fav_id"),
 )
 
 prod_fav = Table(
     "prod_fav",
     db.metadata,
-    Column("prod_id", ForeignKey("product.id")),
-    Column("fav_id", ForeignKey("favorite.id")),
+    Column("prod_id", ForeignKey("product.id"), primary_key=True),
+    Column("fav_id", ForeignKey("favorite.id"), primary_key=True),
+    Index("ix_prod_fav_fav_id", "fav_id"),
 )
 
 class RoleEnum(enum.Enum):
@@ -62,6 +83,7 @@ class User(db.Model):
     favorites: Mapped[list['Favorite']] = relationship(
         secondary="user_fav", back_populates="users")
 
+    @timed("serialize")
     def serialize(self):
         return {
             "id": self.id,
@@ -81,6 +103,14 @@ class CategoryEnum(enum.Enum):
 
 
 class Product(db.Model):
+    # Indices compuestos para la paginacion por cursor (created_at, id) de GET /products
+    __table_args__ = (
+        Index("ix_product_created_at_id", "created_at", "id"),
+        Index("ix_product_category_created_at_id", "category", "created_at", "id"),
+        Index("ix_product_artist_id_created_at_id", "artist_id", "created_at", "id"),
+        Index("ix_product_price_id", "price", "id"),
+    )
+
     id: Mapped[int] = mapped_column(
         Integer, primary_key=True, autoincrement=True)
     artist_id: Mapped[int] = mapped_column(
@@ -90,6 +120,8 @@ class Product(db.Model):
         Enum(CategoryEnum, name="categoryenum"), nullable=False)
     details: Mapped[str] = mapped_column(String(1000), nullable=False)
     amount: Mapped[int] = mapped_column(Integer, nullable=False)
+    # Unidades retenidas por checkouts en curso (api/reservations.py); disponibles = amount - reserved
+    reserved: Mapped[int] = mapped_column(Integer, nullable=False, default=0, server_default="0")
     price: Mapped[int] = mapped_column(Integer, nullable=False)
     discount: Mapped[int] = mapped_column(Integer, nullable=False)
     img_path: Mapped[str] = mapped_column(String(120), nullable=False)
@@ -105,6 +137,7 @@ class Product(db.Model):
         secondary="prod_order", back_populates="products")
     item: Mapped['OrderItem'] = relationship(back_populates="product")
 
+    @timed("serialize")
     def serialize(self):
         return {
             "id": self.id,
@@ -129,6 +162,7 @@ class Favorite(db.Model):
     products: Mapped[list["Product"]] = relationship(
         secondary="prod_fav", back_populates="favorites")
 
+    @timed("serialize")
     def serialize(self):
         return {
             "id": self.id
@@ -138,6 +172,9 @@ class Favorite(db.Model):
 class Order(db.Model):
     id: Mapped[int] = mapped_column(
         Integer, primary_key=True, autoincrement=True)
+    # Fecha del pago confirmado por Stripe; None mientras es el carrito abierto
+    paid_at: Mapped[datetime | None] = mapped_column(
+        DateTime(timezone=True), nullable=True)
 
     users: Mapped[list['User']] = relationship(
         secondary="user_order", back_populates="orders")
@@ -145,6 +182,7 @@ class Order(db.Model):
         secondary="prod_order", back_populates="orders")
     items: Mapped[list['OrderItem']] = relationship(back_populates="order")
 
+    @timed("serialize")
     def serialize(self):
         return {
             "id": self.id,
@@ -152,6 +190,11 @@ class Order(db.Model):
 
 
 class OrderItem(db.Model):
+    __table_args__ = (
+        UniqueConstraint("order_id", "prod_id", name="uq_order_item_order_id_prod_id"),
+        Index("ix_order_item_prod_id", "prod_id"),
+    )
+
     id: Mapped[int] = mapped_column(
         Integer, primary_key=True, autoincrement=True)
     order_id: Mapped[int] = mapped_column(
@@ -163,10 +206,39 @@ class OrderItem(db.Model):
     order: Mapped['Order'] = relationship(back_populates="items")
     product: Mapped['Product'] = relationship(back_populates="item")
 
+    @timed("serialize")
+    def serialize(self):
+        return {
+            "id": self.id,
+            "order_id": self.order_id,
+            "prod_id": self.prod_id,
+            "quantity": self.quantity,
+        }
+
+
+class Reservation(db.Model):
+    # Retencion temporal de stock de un pedido mientras se paga (api/reservations.py)
+    __table_args__ = (
+        UniqueConstraint("order_id", "prod_id", name="uq_reservation_order_id_prod_id"),
+        Index("ix_reservation_expires_at", "expires_at"),
+    )
+
+    id: Mapped[int] = mapped_column(
+        Integer, primary_key=True, autoincrement=True)
+    order_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("order.id"), nullable=False)
+    prod_id: Mapped[int] = mapped_column(
+        Integer, ForeignKey("product.id"), nullable=False)
+    quantity: Mapped[int] = mapped_column(Integer, nullable=False)
+    expires_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True), nullable=False)
+
+    @timed("serialize")
     def serialize(self):
         return {
             "id": self.id,
             "order_id": self.order_id,
             "prod_id": self.prod_id,
             "quantity": self.quantity,
-        }
\ No newline at end of file
+            "expires_at": self.expires_at,
+        }
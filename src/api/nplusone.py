@@ -0,0 +1,119 @@
+"""
+Detector de consultas N+1 para desarrollo y tests.
+Normaliza cada sentencia SQL de una peticion (sin literales ni listas IN) y, cuando
+la misma forma se repite NPLUSONE_THRESHOLD veces, avisa con la linea del codigo que
+la lanzo. Modos (config NPLUSONE): "off", "log" o "raise" (la peticion falla con
+NPlusOneError, pensado para los tests). Por defecto "log" con FLASK_DEBUG=1 y "off" si no.
+"""
+import os
+import re
+import logging
+import sysconfig
+import traceback
+from contextvars import ContextVar
+from flask import request, request_started, request_finished
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SRC_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STDLIB_DIR = sysconfig.get_paths()["stdlib"]
+MODES = ("off", "log", "raise")
+
+_current = ContextVar("nplusone", default=None)
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_POSTCOMPILE = re.compile(r"\(?__\[POSTCOMPILE_\w+\]\)?")
+_PLACEHOLDERS = re.compile(r"\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+class NPlusOneError(AssertionError):
+    pass
+
+
+def normalize(statement):
+    # Misma forma para la misma consulta con distintos parametros o listas IN de distinto tamano
+    shape = _STRING.sub("?", statement)
+    shape = _POSTCOMPILE.sub("(?)", shape)
+    shape = _NUMBER.sub("?", shape)
+    shape = _PLACEHOLDERS.sub("(?)", shape)
+    return _SPACES.sub(" ", shape).strip()
+
+
+def _call_site():
+    # Ultimo frame de codigo propio: ni este modulo, ni la libreria estandar, ni dependencias
+    for frame in reversed(traceback.extract_stack()):
+        filename = frame.filename
+        if (filename == __file__ or filename.startswith(STDLIB_DIR) or "site-packages" in filename
+                or filename.startswith("<")):
+            continue
+        if filename.startswith(SRC_DIR):
+            filename = os.path.relpath(filename, SRC_DIR)
+        return f"{filename}:{frame.lineno} in {frame.name}"
+    return "<unknown>"
+
+
+class QueryCounter:
+    __slots__ = ("threshold", "shapes", "repeats", "flagged")
+
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.shapes = {}
+        self.repeats = {}
+        self.flagged = {}
+
+    def add(self, statement):
+        shape = normalize(statement)
+        count = self.shapes.get(shape, 0) + 1
+        self.shapes[shape] = count
+        # La linea que se avisa es la de la primera repeticion (segunda ejecucion), no la del umbral
+        if count == min(self.threshold, 2):
+            self.repeats[shape] = _call_site()
+        if count == self.threshold:
+            self.flagged[shape] = self.repeats.pop(shape)
+
+    def report(self):
+        return [{"statement": shape, "count": self.shapes[shape], "call_site": site}
+                for shape, site in self.flagged.items()]
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    counter = _current.get()
+    if counter is not None:
+        counter.add(statement)
+
+
+def _request_started(sender, **extra):
+    if sender.config["NPLUSONE"] != "off":
+        _current.set(QueryCounter(sender.config["NPLUSONE_THRESHOLD"]))
+
+
+def _request_finished(sender, response, **extra):
+    counter = _current.get()
+    if counter is None:
+        return
+    _current.set(None)
+    problems = counter.report()
+    if not problems:
+        return
+    endpoint = f"{request.method} {request.path}"
+    for problem in problems:
+        logger.warning("N+1 query in %s: %s repeated %d times (first repeat at %s)",
+                       endpoint, problem["statement"], problem["count"], problem["call_site"])
+    if sender.config["NPLUSONE"] == "raise":
+        raise NPlusOneError(f"N+1 queries in {endpoint}: " + "; ".join(
+            f"{problem['statement']} x{problem['count']} at {problem['call_site']}" for problem in problems))
+
+
+def setup_nplusone(app):
+    debug = os.getenv("FLASK_DEBUG") == "1"
+    app.config.setdefault("NPLUSONE", os.getenv("NPLUSONE", "log" if debug else "off"))
+    app.config.setdefault("NPLUSONE_THRESHOLD", int(os.getenv("NPLUSONE_THRESHOLD", 5)))
+    if app.config["NPLUSONE"] not in MODES:
+        raise ValueError(f"NPLUSONE must be one of {', '.join(MODES)}")
+    request_started.connect(_request_started, app)
+    request_finished.connect(_request_finished, app)
@@ -0,0 +1,196 @@
+"""
+Checkout de Stripe para POST /create-checkout-session.
+Las llamadas usan un StripeClient con un pool de conexiones HTTP (requests.Session),
+timeouts cortos y los reintentos de la libreria (backoff exponencial con jitter).
+La idempotency key sale del usuario, del pedido y de su reserva de stock (lineas y caducidad),
+asi los reintentos y los dobles clics devuelven la misma sesion en vez de crear otra.
+Con STRIPE_EXECUTION=thread la llamada va a un pool de hilos y la peticion espera como
+mucho STRIPE_WAIT_SECONDS; si Stripe tarda mas se responde 202 y el cliente repite el POST.
+La sesion caduca (expires_at) CHECKOUT_WEBHOOK_GRACE_SECONDS antes que la reserva de stock
+del pedido, asi no se puede pagar un carrito cuya reserva ya se haya liberado.
+STRIPE_API_BASE permite apuntar al stub local (flask stripe-stub) para pruebas de carga.
+Los eventos de POST /stripe/webhook se verifican con STRIPE_WEBHOOK_SECRET.
+stripe y requests se importan en la primera llamada: los workers que no hacen checkout no los cargan.
+"""
+import hashlib
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from .cache import LRUCache
+from .metrics import observe_stripe
+
+STRIPE_CONNECT_TIMEOUT = float(os.getenv("STRIPE_CONNECT_TIMEOUT", 2))
+STRIPE_READ_TIMEOUT = float(os.getenv("STRIPE_READ_TIMEOUT", 10))
+STRIPE_MAX_RETRIES = int(os.getenv("STRIPE_MAX_RETRIES", 2))
+STRIPE_POOL_SIZE = int(os.getenv("STRIPE_POOL_SIZE", 10))
+STRIPE_EXECUTION = os.getenv("STRIPE_EXECUTION", "sync")
+STRIPE_WAIT_SECONDS = float(os.getenv("STRIPE_WAIT_SECONDS", 2))
+# Stripe no acepta Checkout Sessions que caduquen antes de 30 minutos
+STRIPE_SESSION_MIN_SECONDS = 1800
+# La sesion se cierra este margen antes que la reserva de stock: un pago del ultimo
+# momento aun encuentra la reserva cuando llega su webhook
+CHECKOUT_WEBHOOK_GRACE_SECONDS = int(os.getenv("CHECKOUT_WEBHOOK_GRACE_SECONDS", 600))
+# Vida minima que debe quedarle a una reserva para abrir (o repetir) una sesion sobre ella
+CHECKOUT_MIN_HOLD_SECONDS = STRIPE_SESSION_MIN_SECONDS + CHECKOUT_WEBHOOK_GRACE_SECONDS + 60
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import requests
+                import stripe
+                from requests.adapters import HTTPAdapter
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=STRIPE_POOL_SIZE)
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                options = {}
+                if os.getenv("STRIPE_API_BASE"):
+                    options["base_addresses"] = {"api": os.getenv("STRIPE_API_BASE")}
+                _client = stripe.StripeClient(
+                    os.getenv("STRIPE_API_KEY") or "",
+                    http_client=stripe.RequestsClient(
+                        timeout=(STRIPE_CONNECT_TIMEOUT, STRIPE_READ_TIMEOUT), session=session),
+                    max_network_retries=STRIPE_MAX_RETRIES,
+                    **options)
+    return _client
+
+
+def reset_client():
+    # Para cambiar STRIPE_API_BASE/STRIPE_API_KEY en caliente (p.ej. flask bench-checkout)
+    global _client
+    with _client_lock:
+        _client = None
+
+
+def checkout_params(items, backend_url):
+    """
+    Parametros de la Checkout Session a partir de los items del carrito del front
+    ({name, unit_amount, quantity}). Lanza KeyError/TypeError/ValueError si no son validos.
+    """
+    line_items = []
+    for item in items:
+        quantity = int(item["quantity"])
+        unit_amount = int(item["unit_amount"])
+        if quantity < 1 or unit_amount < 0:
+            raise ValueError("quantity must be positive and unit_amount not negative")
+        line_items.append({
+            "price_data": {
+                "currency": "eur",
+                "product_data": {"name": item["name"][:127]},
+                "unit_amount": unit_amount,
+            },
+            "quantity": quantity,
+        })
+    if not line_items:
+        raise ValueError("the cart is empty")
+    return {
+        "mode": "payment",
+        "line_items": line_items,
+        "payment_method_types": ["card"],
+        "phone_number_collection": {"enabled": True},
+        "shipping_address_collection": {"allowed_countries": ["ES"]},
+        "allow_promotion_codes": False,
+        "success_url": backend_url,
+        "cancel_url": backend_url,
+    }
+
+
+def session_expires_at(hold_expires_at):
+    # expires_at de la Checkout Session (epoch) para una reserva que caduca en hold_expires_at
+    return int(hold_expires_at.timestamp()) - CHECKOUT_WEBHOOK_GRACE_SECONDS
+
+
+def idempotency_key(owner, params):
+    """
+    Misma clave mientras no cambie el estado del carrito: params lleva el pedido
+    (client_reference_id), sus lineas y el expires_at que sale de su reserva, que reserve()
+    conserva en los reintentos. Una reserva nueva (carrito cambiado o caducado) da otra clave.
+    """
+    raw = json.dumps([owner, params], sort_keys=True, separators=(",", ":"))
+    return f"checkout-{hashlib.sha256(raw.encode()).hexdigest()[:40]}"
+
+
+def _create_session(params, key):
+    with observe_stripe("checkout.session.create"):
+        session = get_client().v1.checkout.sessions.create(params=params, options={"idempotency_key": key})
+    return session.url
+
+
+def parse_webhook(payload, signature):
+    # Evento de Stripe (dict) con la firma comprobada. Lanza ValueError si no es valido
+    import stripe
+    secret = os.getenv("STRIPE_WEBHOOK_SECRET")
+    if not secret:
+        raise ValueError("STRIPE_WEBHOOK_SECRET is not configured")
+    try:
+        stripe.WebhookSignature.verify_header(payload.decode("utf-8"), signature or "", secret)
+    except (stripe.SignatureVerificationError, UnicodeDecodeError) as e:
+        raise ValueError(str(e))
+    return json.loads(payload)
+
+
+class CheckoutRunner:
+    """
+    Modo thread: una sola llamada en curso por idempotency key y por worker.
+    El resultado queda en memoria para que el POST repetido por el cliente lo recoja.
+    """
+
+    def __init__(self, max_workers, wait):
+        self.wait = wait
+        self.results = LRUCache(maxsize=4096, ttl=STRIPE_SESSION_MIN_SECONDS)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stripe")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def run(self, params, key, on_failure=None):
+        """
+        Devuelve la URL de la sesion, o None si Stripe aun no ha respondido.
+        Si la llamada falla, on_failure(error) se ejecuta en el hilo del pool aunque
+        ya no quede ninguna peticion esperando el resultado.
+        """
+        url = self.results.get(key)
+        if url is not None:
+            return url
+        with self._lock:
+            future = self._pending.get(key)
+            if future is None:
+                future = self._pending[key] = self._executor.submit(self._create, params, key, on_failure)
+        try:
+            return future.result(timeout=self.wait)
+        except FutureTimeout:
+            return None
+
+    def _create(self, params, key, on_failure):
+        try:
+            url = _create_session(params, key)
+            self.results.set(key, url)
+            return url
+        except Exception as e:
+            if on_failure is not None:
+                on_failure(e)
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+
+_runner = None
+
+
+def start_checkout(params, key, on_failure=None):
+    # on_failure solo se usa en modo thread: en modo sync el error llega al que llama
+    global _runner
+    if STRIPE_EXECUTION != "thread":
+        return _create_session(params, key)
+    if _runner is None:
+        with _client_lock:
+            if _runner is None:
+                _runner = CheckoutRunner(STRIPE_POOL_SIZE, STRIPE_WAIT_SECONDS)
+    return _runner.run(params, key, on_failure)
@@ -0,0 +1,169 @@
+"""
+Lecturas en replicas (DATABASE_REPLICA_URLS, separadas por comas).
+Cada replica es un bind de Flask-SQLAlchemy (replica_0, replica_1...). Los endpoints
+marcados con @read_replica hacen sus SELECT en una replica elegida por round-robin;
+las escrituras y el resto de endpoints siguen en la base principal.
+Una replica que falla se marca como caida y se vuelve a probar cada
+REPLICA_RETRY_SECONDS; si falla en mitad de una peticion, la vista se repite en la principal.
+"""
+import os
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.sql.dml import UpdateBase
+
+REPLICA_RETRY_SECONDS = float(os.getenv("REPLICA_RETRY_SECONDS", 30))
+# Tras una escritura, durante este tiempo se lee de la principal (la replica puede ir con retraso)
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("REPLICA_MAX_LAG_SECONDS", 5))
+
+
+class _Route:
+    __slots__ = ("bind_key", "failed")
+
+    def __init__(self, bind_key):
+        self.bind_key = bind_key
+        self.failed = False
+
+
+_route = ContextVar("replica_route", default=None)
+
+
+def replica_binds(urls):
+    """
+    SQLALCHEMY_BINDS para las URLs de DATABASE_REPLICA_URLS. En Postgres se limita el
+    tiempo de conexion para que una replica caida no bloquee la peticion.
+    """
+    binds = {}
+    for url in (url.strip() for url in urls.split(",")):
+        if not url:
+            continue
+        url = url.replace("postgres://", "postgresql://")
+        options = {"url": url, "pool_pre_ping": True}
+        if url.startswith("postgresql"):
+            options["connect_args"] = {"connect_timeout": int(os.getenv("REPLICA_CONNECT_TIMEOUT", 2))}
+        binds[f"replica_{len(binds)}"] = options
+    return binds
+
+
+class ReplicaRouter:
+    # Round-robin entre las replicas sanas. Thread-safe
+
+    def __init__(self):
+        self.bind_keys = []
+        self._down_until = {}
+        self._next = 0
+        self._lock = threading.Lock()
+        self.db = None
+
+    def init_app(self, app, db):
+        self.db = db
+        self.bind_keys = sorted(key for key in app.config.get("SQLALCHEMY_BINDS", {})
+                                if key.startswith("replica_"))
+        with app.app_context():
+            for key in self.bind_keys:
+                event.listen(db.engines[key], "handle_error", self._handle_error(key))
+
+    def _handle_error(self, bind_key):
+        def handle_error(context):
+            if context.is_disconnect or isinstance(context.sqlalchemy_exception, DBAPIError):
+                self.mark_down(bind_key)
+                route = _route.get()
+                if route is not None and route.bind_key == bind_key:
+                    route.failed = True
+        return handle_error
+
+    def mark_down(self, bind_key):
+        with self._lock:
+            self._down_until[bind_key] = time.monotonic() + REPLICA_RETRY_SECONDS
+
+    def _probe(self, bind_key):
+        try:
+            with self.db.engines[bind_key].connect() as connection:
+                connection.exec_driver_sql("SELECT 1")
+            return True
+        except DBAPIError:
+            return False
+
+    def choose(self):
+        # Devuelve el bind de la siguiente replica sana, o None para usar la principal
+        now = time.monotonic()
+        with self._lock:
+            candidates = self.bind_keys[self._next:] + self.bind_keys[:self._next]
+            self._next = (self._next + 1) % max(1, len(self.bind_keys))
+            retry = []
+            for key in candidates:
+                down_until = self._down_until.get(key)
+                if down_until is None:
+                    return key
+                if down_until <= now:
+                    # Solo un hilo reintenta: mientras tanto sigue marcada como caida
+                    self._down_until[key] = now + REPLICA_RETRY_SECONDS
+                    retry.append(key)
+        for key in retry:
+            if self._probe(key):
+                with self._lock:
+                    self._down_until.pop(key, None)
+                return key
+        return None
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return {key: "down" if self._down_until.get(key, 0) > now else "up" for key in self.bind_keys}
+
+
+replica_router = ReplicaRouter()
+
+
+class RoutingSession(Session):
+    """
+    Sesion de Flask-SQLAlchemy que manda los SELECT a la replica de la peticion en curso.
+    Los flush y las sentencias INSERT/UPDATE/DELETE siempre van a la principal.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        route = _route.get()
+        if (route is not None and bind is None and not self._flushing
+                and not isinstance(clause, UpdateBase)):
+            return self._db.engines[route.bind_key]
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def read_replica(*versions):
+    """
+    Decorador para vistas de solo lectura. `versions` son las SharedVersion de los datos
+    que lee la vista: si alguna cambio hace menos de REPLICA_MAX_LAG_SECONDS se usa la
+    principal, para no servir (ni cachear) datos anteriores a la ultima escritura.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not replica_router.bind_keys:
+                return view(*args, **kwargs)
+            recent = time.time_ns() - REPLICA_MAX_LAG_SECONDS * 1e9
+            if any(version.current() > recent for version in versions):
+                return view(*args, **kwargs)
+            bind_key = replica_router.choose()
+            if bind_key is None:
+                return view(*args, **kwargs)
+
+            route = _Route(bind_key)
+            token = _route.set(route)
+            try:
+                response = view(*args, **kwargs)
+            except Exception:
+                if not route.failed:
+                    raise
+            finally:
+                _route.reset(token)
+            if not route.failed:
+                return response
+            # La replica fallo durante la peticion: se repite la lectura en la principal
+            replica_router.db.session.rollback()
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,159 @@
+"""
+Reservas de stock para el checkout. Al pulsar "Pagar" se retienen las unidades del
+carrito durante RESERVATION_TTL_SECONDS: el pago confirmado (webhook de Stripe) las
+descuenta de Product.amount y, si no se paga, se liberan al caducar. Solo se descuenta
+lo retenido, nunca el contenido actual del carrito.
+Cada retencion es un UPDATE condicional (reserved + q solo si amount - reserved >= q):
+no hay lectura previa ni SELECT ... FOR UPDATE, asi el bloqueo de la fila del producto
+dura lo que tarda esa sentencia en confirmarse y no lo que tarda el comprador en pagar.
+Las retenciones caducadas se liberan con `flask sweep-reservations`, lanzado por un
+programador (cron, Heroku Scheduler) y no desde los workers; usa FOR UPDATE SKIP LOCKED en
+Postgres para no esperar a las confirmaciones en curso. Si el barrido aun no ha pasado,
+reserve() recupera las caducadas de los productos que le faltan antes de dar OutOfStock.
+"""
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from .models import db, Product, Reservation
+
+# Debe cubrir la Checkout Session de Stripe (minimo 30 minutos) mas el margen del webhook,
+# ver CHECKOUT_WEBHOOK_GRACE_SECONDS en api/payments.py
+RESERVATION_TTL_SECONDS = int(os.getenv("RESERVATION_TTL_SECONDS", 2700))
+RESERVATION_SWEEP_BATCH = int(os.getenv("RESERVATION_SWEEP_BATCH", 500))
+
+
+class OutOfStock(Exception):
+    def __init__(self, shortages):
+        # shortages: [{"prod_id", "requested", "available"}]
+        super().__init__("There are not that amount of products in stock.")
+        self.shortages = shortages
+
+
+def _take(where):
+    # Borra las retenciones que cumplen `where` y devuelve sus filas (prod_id, quantity)
+    return db.session.execute(
+        db.delete(Reservation).where(where)
+        .returning(Reservation.prod_id, Reservation.quantity)
+        .execution_options(synchronize_session=False)).all()
+
+
+def _by_product(rows):
+    units = defaultdict(int)
+    for prod_id, quantity in rows:
+        units[prod_id] += quantity
+    return units
+
+
+def _update_stock(prod_id, condition=None, **values):
+    statement = db.update(Product).where(Product.id == prod_id)
+    if condition is not None:
+        statement = statement.where(condition)
+    return db.session.execute(
+        statement.values(**values).execution_options(synchronize_session=False)).rowcount
+
+
+def _unreserve(taken):
+    # Siempre en orden de prod_id, igual que reserve(), para no provocar interbloqueos
+    for prod_id, quantity in sorted(taken.items()):
+        _update_stock(prod_id, reserved=Product.reserved - quantity)
+
+
+def _hold(prod_id, quantity):
+    return _update_stock(prod_id, Product.amount - Product.reserved >= quantity,
+                         reserved=Product.reserved + quantity)
+
+
+def _utc(moment):
+    # SQLite devuelve las fechas sin zona horaria (se guardan en UTC)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+
+def reserve(order_id, quantities, ttl=None, now=None, min_remaining=None):
+    """
+    Retiene {prod_id: unidades} para el pedido y devuelve la fecha de caducidad.
+    Sustituye las retenciones anteriores del mismo pedido (otro clic en "Pagar"), salvo
+    que sean exactamente las mismas y les queden al menos `min_remaining` segundos: entonces
+    se conservan con su caducidad, asi un doble clic no cambia la sesion de pago.
+    Todo o nada: lanza OutOfStock si falta alguna unidad y el llamador hace rollback.
+    No hace commit.
+    """
+    now = now or datetime.now(timezone.utc)
+    wanted = sorted((prod_id, quantity) for prod_id, quantity in quantities.items() if quantity > 0)
+    if min_remaining is not None and wanted:
+        held = db.session.execute(
+            db.select(Reservation.prod_id, Reservation.quantity, Reservation.expires_at)
+            .where(Reservation.order_id == order_id)).all()
+        if (sorted((prod_id, quantity) for prod_id, quantity, _ in held) == wanted
+                and min(_utc(expires_at) for _, _, expires_at in held) >= now + timedelta(seconds=min_remaining)):
+            return min(_utc(expires_at) for _, _, expires_at in held)
+
+    expires_at = now + timedelta(seconds=RESERVATION_TTL_SECONDS if ttl is None else ttl)
+    _unreserve(_by_product(_take(Reservation.order_id == order_id)))
+
+    failed = [(prod_id, quantity) for prod_id, quantity in wanted if not _hold(prod_id, quantity)]
+    if failed:
+        # Retenciones caducadas de esos productos que el barrido aun no ha liberado
+        stale = _by_product(_take(Reservation.prod_id.in_([prod_id for prod_id, quantity in failed])
+                                  & (Reservation.expires_at <= now)))
+        if stale:
+            _unreserve(stale)
+            failed = [(prod_id, quantity) for prod_id, quantity in failed if not _hold(prod_id, quantity)]
+    if failed:
+        available = dict(db.session.execute(
+            db.select(Product.id, Product.amount - Product.reserved)
+            .where(Product.id.in_([prod_id for prod_id, quantity in failed]))).all())
+        raise OutOfStock([{"prod_id": prod_id, "requested": quantity,
+                           "available": max(0, available.get(prod_id) or 0)}
+                          for prod_id, quantity in failed])
+
+    if wanted:
+        db.session.execute(db.insert(Reservation), [
+            {"order_id": order_id, "prod_id": prod_id, "quantity": quantity, "expires_at": expires_at}
+            for prod_id, quantity in wanted])
+    return expires_at
+
+
+def release(order_id):
+    # Devuelve al stock disponible las retenciones del pedido. No hace commit
+    taken = _by_product(_take(Reservation.order_id == order_id))
+    _unreserve(taken)
+    return dict(taken)
+
+
+def confirm(order_id):
+    """
+    Pago confirmado: descuenta de Product.amount las unidades retenidas por el pedido.
+    Solo cuenta lo retenido: sin retenciones vivas (evento repetido, o la retencion caduco
+    antes del pago) no toca el stock. Devuelve {prod_id: unidades descontadas}. No hace commit.
+    """
+    held = _by_product(_take(Reservation.order_id == order_id))
+    for prod_id, quantity in sorted(held.items()):
+        _update_stock(prod_id, amount=Product.amount - quantity, reserved=Product.reserved - quantity)
+    return dict(held)
+
+
+def sweep_expired(now=None, batch=RESERVATION_SWEEP_BATCH):
+    """
+    Libera las retenciones caducadas por lotes de `batch`, con un commit por lote.
+    Devuelve las unidades liberadas.
+    """
+    now = now or datetime.now(timezone.utc)
+    released = 0
+    while True:
+        # SQLite ignora FOR UPDATE (las escrituras ya van serializadas)
+        expired = (db.select(Reservation.id)
+                   .where(Reservation.expires_at <= now)
+                   .order_by(Reservation.id)
+                   .limit(batch)
+                   .with_for_update(skip_locked=True))
+        try:
+            rows = _take(Reservation.id.in_(expired.scalar_subquery()))
+            taken = _by_product(rows)
+            _unreserve(taken)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        released += sum(taken.values())
+        if len(rows) < batch:
+            return released
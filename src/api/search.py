@@ -0,0 +1,57 @@
+"""
+Busqueda de texto completo sobre Product.name y Product.details.
+En Postgres usa un indice GIN sobre un tsvector y en SQLite una tabla virtual FTS5
+(product_fts), ambos creados por la migracion correspondiente.
+"""
+import re
+from sqlalchemy import Table, Column, Integer, MetaData, func, literal_column
+from .models import db, Product
+
+# Debe ser la misma expresion que la del indice GIN (ix_product_search) para que se use
+PG_DOCUMENT = literal_column("to_tsvector('simple', product.name || ' ' || product.details)")
+
+# Tabla virtual FTS5 de SQLite. Va en su propio MetaData para que create_all/Alembic no la toquen
+product_fts = Table("product_fts", MetaData(), Column("rowid", Integer))
+FTS_TABLE = literal_column("product_fts")
+
+MAX_TERMS = 8
+
+
+def search_terms(q):
+    return re.findall(r"\w+", (q or "").lower())[:MAX_TERMS]
+
+
+def _matching(columns, terms):
+    # Todos los terminos son obligatorios y coinciden por prefijo
+    if db.engine.dialect.name == "postgresql":
+        query = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+        return (db.select(*columns).where(PG_DOCUMENT.op("@@")(query)),
+                func.ts_rank(PG_DOCUMENT, query))
+
+    query = " ".join(f'"{term}"*' for term in terms)
+    select = (db.select(*columns)
+              .select_from(product_fts)
+              .join(Product, Product.id == product_fts.c.rowid)
+              .where(FTS_TABLE.op("MATCH")(query)))
+    # bm25 es menor cuanto mas relevante: se invierte para ordenar igual que ts_rank
+    return select, -func.bm25(FTS_TABLE)
+
+
+def search_products(terms, columns, category=None, limit=24, offset=0):
+    """
+    Devuelve (filas, facetas): las filas de la pagina pedida ordenadas por relevancia
+    (la ultima columna es el rank) y el numero de resultados por categoria.
+    Las facetas ignoran el filtro de categoria para poder mostrar el resto de opciones.
+    """
+    query, rank = _matching(columns, terms)
+    query = query.add_columns(rank.label("rank"))
+    if category is not None:
+        query = query.where(Product.category == category)
+    rows = db.session.execute(
+        query.order_by(literal_column("rank").desc(), Product.id.desc())
+        .limit(limit).offset(offset)).all()
+
+    facet_query, _ = _matching([Product.category, func.count()], terms)
+    facets = {category.value: total for category, total in
+              db.session.execute(facet_query.group_by(Product.category)).all()}
+    return rows, facets
@@ -0,0 +1,130 @@
+import enum
+import json
+from datetime import date, datetime, timezone
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import DateTime, Enum
+from .models import db, User, Product, Order, OrderItem
+from .timing import timed
+
+# orjson es opcional: si esta instalado se usa, si no se usa el json de la libreria estandar
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(o):
+    if isinstance(o, enum.Enum):
+        return o.value
+    return DefaultJSONProvider.default(o)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SORT_KEYS
+
+    @timed("json")
+    def dumps_bytes(obj):
+        return orjson.dumps(obj, default=_default, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    @timed("json")
+    def dumps_bytes(obj):
+        return json.dumps(obj, default=_default, sort_keys=True,
+                          ensure_ascii=False, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """
+    Proveedor JSON de Flask que usa orjson cuando esta disponible.
+    Mantiene el formato de fechas de Flask (HTTP date) para no cambiar las respuestas.
+    """
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps_bytes(obj).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+
+_DAYS = ("Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun")
+_MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def _http_date(value):
+    # Igual que werkzeug.http.http_date pero sin pasar por email.utils
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    elif value.tzinfo is not None:
+        value = value.astimezone(timezone.utc)
+    return (f"{_DAYS[value.weekday()]}, {value.day:02d} {_MONTHS[value.month - 1]} "
+            f"{value.year:04d} {value.hour:02d}:{value.minute:02d}:{value.second:02d} GMT")
+
+
+def _converter(column):
+    if isinstance(column.type, Enum):
+        return lambda value: value.value
+    if isinstance(column.type, DateTime):
+        return lambda value: _http_date(value) if isinstance(value, date) else value
+    return None
+
+
+class RowSerializer:
+    """
+    Serializador "compilado" para un modelo: selecciona solo las columnas necesarias
+    (sin hidratar objetos del ORM) y convierte cada fila con conversores calculados
+    una sola vez, escribiendo el resultado directamente a bytes.
+    El resultado es identico al de Model.serialize() + jsonify.
+    """
+
+    def __init__(self, *columns):
+        self.columns = columns
+        self.keys = tuple(column.key for column in columns)
+        self._converters = tuple(
+            (index, converter) for index, converter in
+            ((index, _converter(column)) for index, column in enumerate(columns))
+            if converter is not None)
+
+    def select(self):
+        return db.select(*self.columns)
+
+    def to_dict(self, row):
+        values = list(row)
+        for index, converter in self._converters:
+            if values[index] is not None:
+                values[index] = converter(values[index])
+        return dict(zip(self.keys, values))
+
+    @timed("serialize")
+    def to_dicts(self, rows):
+        return [self.to_dict(row) for row in rows]
+
+    def dumps(self, rows):
+        return dumps_bytes(self.to_dicts(rows))
+
+    def dumps_one(self, row):
+        return dumps_bytes(self.to_dicts((row,))[0])
+
+
+user_serializer = RowSerializer(
+    User.id, User.firstname, User.lastname, User.email,
+    User.rol, User.is_active, User.created_at)
+
+product_serializer = RowSerializer(
+    Product.id, Product.artist_id, Product.name, Product.category, Product.details,
+    Product.amount, Product.price, Product.discount, Product.img_path, Product.created_at)
+
+order_item_serializer = RowSerializer(
+    OrderItem.id, OrderItem.order_id, OrderItem.prod_id, OrderItem.quantity)
+
+order_serializer = RowSerializer(Order.id)
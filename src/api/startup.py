@@ -0,0 +1,83 @@
+"""
+Tareas de arranque que tocan la base de datos (resetear secuencias, etc.).
+No se ejecutan al importar la app: se lanzan una vez por despliegue con
+`flask run-startup-tasks` desde el paso release del Procfile (y desde render_build.sh).
+En Postgres se toma un advisory lock: si otra instancia ya las esta ejecutando, se saltan.
+Para anadir una tarea basta con decorarla con @startup_task("nombre").
+"""
+import time
+from sqlalchemy import text
+from .logs import logger
+from .models import db
+
+# Clave del advisory lock de Postgres (cualquier bigint fijo de esta app)
+STARTUP_LOCK_KEY = 7301190423
+
+STARTUP_TASKS = {}
+
+
+def startup_task(name):
+    def decorator(task):
+        STARTUP_TASKS[name] = task
+        return task
+    return decorator
+
+
+@startup_task("reset-user-id-sequence")
+def reset_user_id_sequence():
+    # Tras cargar usuarios con id explicito la secuencia queda por detras de MAX(id)
+    if db.engine.url.get_backend_name() != "postgresql":
+        return
+    db.session.execute(text("""
+        SELECT setval(
+          pg_get_serial_sequence('"user"', 'id'),
+          COALESCE((SELECT MAX(id) FROM "user"), 0),
+          true
+        );
+    """))
+
+
+def _try_lock(connection):
+    if connection.dialect.name != "postgresql":
+        return True
+    return connection.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": STARTUP_LOCK_KEY}).scalar()
+
+
+def _unlock(connection):
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": STARTUP_LOCK_KEY})
+
+
+def run_startup_tasks(names=None):
+    """
+    Ejecuta las tareas registradas (o solo `names`), cada una con su commit.
+    Devuelve [(nombre, segundos, error)], o None si otra instancia tiene el lock.
+    Necesita un app context.
+    """
+    unknown = set(names or ()) - set(STARTUP_TASKS)
+    if unknown:
+        raise KeyError(f"Unknown startup tasks: {', '.join(sorted(unknown))}")
+
+    # El lock vive en su propia conexion, fuera de la sesion que usan las tareas
+    with db.engine.connect() as connection:
+        if not _try_lock(connection):
+            logger.info("Startup tasks already running in another instance, skipping")
+            return None
+        try:
+            results = []
+            for name, task in STARTUP_TASKS.items():
+                if names and name not in names:
+                    continue
+                start = time.perf_counter()
+                error = None
+                try:
+                    task()
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    logger.exception("Startup task %s failed", name)
+                    error = str(e)
+                results.append((name, time.perf_counter() - start, error))
+            return results
+        finally:
+            _unlock(connection)
@@ -0,0 +1,117 @@
+"""
+Servidor de los ficheros del front compilado (dist/).
+Al arrancar se recorre dist/ una sola vez y se guarda en memoria cada fichero con su
+tamano, fecha, ETag (hash del contenido) y sus variantes precomprimidas .br/.gz
+(generadas por `npm run build`, ver compress-dist.mjs). Las peticiones no tocan el
+sistema de ficheros salvo para leer el fichero que se envia.
+Los bundles de Vite llevan el hash en el nombre (assets/index-4f9a1c2b.js), asi que se
+cachean un ano como immutable; index.html se revalida cada STATIC_INDEX_MAX_AGE segundos.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+from flask import request, send_file
+from werkzeug.exceptions import NotFound
+
+STATIC_IMMUTABLE_MAX_AGE = int(os.getenv("STATIC_IMMUTABLE_MAX_AGE", 365 * 24 * 3600))
+STATIC_INDEX_MAX_AGE = int(os.getenv("STATIC_INDEX_MAX_AGE", 60))
+STATIC_MAX_AGE = int(os.getenv("STATIC_MAX_AGE", 3600))
+
+# Nombre con hash de contenido que genera Vite: nombre-<hash>.ext
+_HASHED_NAME = re.compile(r"-[A-Za-z0-9_-]{8,}\.[A-Za-z0-9]+$")
+# Orden de preferencia si el navegador acepta varias
+ENCODINGS = (("br", ".br"), ("gzip", ".gz"))
+INDEX = "index.html"
+
+
+def _file_etag(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:20]
+
+
+class StaticFile:
+    __slots__ = ("path", "mimetype", "etag", "mtime", "max_age", "immutable", "variants")
+
+    def __init__(self, path, relpath, index=False):
+        self.path = path
+        self.mimetype = mimetypes.guess_type(relpath)[0] or "application/octet-stream"
+        self.etag = _file_etag(path)
+        self.mtime = os.stat(path).st_mtime
+        self.immutable = relpath.startswith("assets/") and bool(_HASHED_NAME.search(relpath))
+        if index:
+            self.max_age = STATIC_INDEX_MAX_AGE
+        elif self.immutable:
+            self.max_age = STATIC_IMMUTABLE_MAX_AGE
+        else:
+            self.max_age = STATIC_MAX_AGE
+        # {encoding: (ruta, etag)}. Una variante mas antigua que el original se ignora
+        self.variants = {}
+        for encoding, suffix in ENCODINGS:
+            variant = path + suffix
+            if os.path.isfile(variant) and os.stat(variant).st_mtime >= self.mtime:
+                self.variants[encoding] = (variant, f"{self.etag}-{suffix[1:]}")
+
+
+class StaticManifest:
+    """
+    Indice en memoria de un directorio de ficheros estaticos.
+    Las rutas que no existen se sirven como index.html (rutas del router de React),
+    excepto las de assets/, que dan 404.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.files = {}
+        self.build()
+
+    def build(self):
+        files = {}
+        suffixes = tuple(suffix for encoding, suffix in ENCODINGS)
+        for root, dirs, names in os.walk(self.directory):
+            for name in names:
+                if name.endswith(suffixes):
+                    continue
+                path = os.path.join(root, name)
+                relpath = os.path.relpath(path, self.directory).replace(os.sep, "/")
+                files[relpath] = StaticFile(path, relpath, index=relpath == INDEX)
+        self.files = files
+        return len(files)
+
+    def lookup(self, path):
+        static = self.files.get(path)
+        if static is None and not path.startswith("assets/"):
+            static = self.files.get(INDEX)
+        return static
+
+    def send(self, path):
+        static = self.lookup(path)
+        if static is None:
+            raise NotFound()
+
+        filename, etag = static.path, static.etag
+        encoding = None
+        if static.variants:
+            accepted = request.accept_encodings
+            for name, suffix in ENCODINGS:
+                if name in static.variants and accepted[name]:
+                    encoding = name
+                    filename, etag = static.variants[name]
+                    break
+
+        # conditional=True: 304 con If-None-Match/If-Modified-Since y respuestas 206 con Range
+        # download_name: al guardar una variante .br/.gz el nombre sigue siendo el del original
+        response = send_file(filename, mimetype=static.mimetype, conditional=True, etag=etag,
+                             last_modified=static.mtime, max_age=static.max_age,
+                             download_name=os.path.basename(static.path))
+        response.cache_control.public = True
+        if static.immutable:
+            response.cache_control.immutable = True
+        if encoding is not None:
+            response.headers["Content-Encoding"] = encoding
+        if static.variants:
+            response.vary.add("Accept-Encoding")
+        return response
@@ -0,0 +1,72 @@
+"""
+Servidor HTTP minimo que imita POST /v1/checkout/sessions de Stripe, para probar
+y medir el checkout sin red (flask stripe-stub, flask bench-checkout).
+Simula latencia con jitter y errores 500 reintentables, y respeta Idempotency-Key.
+"""
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubState:
+    def __init__(self, latency=0.2, jitter=0.1, error_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.sessions = {}
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+
+
+class StripeStubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body, headers=()):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        state = self.server.state
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path != "/v1/checkout/sessions":
+            self._send(404, {"error": {"type": "invalid_request_error", "message": "Unrecognized request URL"}})
+            return
+
+        time.sleep(max(0.0, state.latency + random.uniform(-state.jitter, state.jitter)))
+        key = self.headers.get("Idempotency-Key")
+        with state.lock:
+            state.requests += 1
+            failed = random.random() < state.error_rate
+            if failed:
+                state.errors += 1
+            elif key is None or key not in state.sessions:
+                session_id = f"cs_test_{uuid.uuid4().hex}"
+                key = key or session_id
+                state.sessions[key] = {
+                    "id": session_id, "object": "checkout.session",
+                    "url": f"http://{self.server.server_name}:{self.server.server_port}/pay/{session_id}"}
+        if failed:
+            self._send(500, {"error": {"type": "api_error", "message": "Stub failure"}},
+                       headers=[("Stripe-Should-Retry", "true")])
+            return
+        self._send(200, state.sessions[key], headers=[("Idempotency-Key", key)])
+
+
+def make_server(host="127.0.0.1", port=12111, latency=0.2, jitter=0.1, error_rate=0.0):
+    server = ThreadingHTTPServer((host, port), StripeStubHandler)
+    server.daemon_threads = True
+    server.state = StubState(latency, jitter, error_rate)
+    return server
@@ -0,0 +1,150 @@
+"""
+Instrumentacion por peticion: numero de consultas SQL y tiempo en la base de datos,
+en serializacion (Model.serialize() y RowSerializer) y en codificacion JSON, y tiempo total.
+Se devuelve en la cabecera Server-Timing y se acumula por endpoint en memoria
+(por proceso) para GET /timing/stats.
+"""
+import os
+import time
+import threading
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from flask import request, request_started, request_finished
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "1") == "1"
+
+_current = ContextVar("request_timing", default=None)
+
+
+def percentiles(latencies):
+    # p50/p95/p99 en milisegundos de una lista de latencias en segundos
+    ordered = sorted(latencies)
+    if not ordered:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0}
+
+    def pick(pct):
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))] * 1000, 2)
+    return {"p50": pick(50), "p95": pick(95), "p99": pick(99)}
+
+
+class RequestTiming:
+    __slots__ = ("started", "queries", "db", "serialize", "json")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db = 0.0
+        self.serialize = 0.0
+        self.json = 0.0
+
+    def header(self, total):
+        return (f'db;dur={self.db * 1000:.2f};desc="{self.queries} queries", '
+                f"serialize;dur={self.serialize * 1000:.2f}, "
+                f"json;dur={self.json * 1000:.2f}, "
+                f"total;dur={total * 1000:.2f}")
+
+
+def timed(phase):
+    # Suma la duracion de la funcion a `phase` ("serialize" o "json") de la peticion en curso
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            timing = _current.get()
+            if timing is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                setattr(timing, phase, getattr(timing, phase) + time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+class EndpointStats:
+    """
+    Agregados por endpoint: total de peticiones desde el arranque y, sobre las ultimas
+    `window` peticiones, medias de cada fase y percentiles del tiempo total.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, timing, total):
+        sample = (total, timing.db, timing.queries, timing.serialize, timing.json)
+        with self._lock:
+            entry = self._endpoints.get(endpoint)
+            if entry is None:
+                entry = self._endpoints[endpoint] = {"count": 0, "samples": deque(maxlen=self.window)}
+            entry["count"] += 1
+            entry["samples"].append(sample)
+
+    def snapshot(self):
+        with self._lock:
+            endpoints = {name: (entry["count"], list(entry["samples"])) for name, entry in self._endpoints.items()}
+
+        result = {}
+        for name, (count, samples) in sorted(endpoints.items()):
+            totals, db_times, queries, serialize_times, json_times = zip(*samples)
+            size = len(samples)
+            result[name] = {
+                "count": count,
+                "window": size,
+                **percentiles(totals),
+                "avg_total_ms": round(sum(totals) / size * 1000, 2),
+                "avg_db_ms": round(sum(db_times) / size * 1000, 2),
+                "avg_serialize_ms": round(sum(serialize_times) / size * 1000, 2),
+                "avg_json_ms": round(sum(json_times) / size * 1000, 2),
+                "avg_queries": round(sum(queries) / size, 2),
+                "max_queries": max(queries),
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+endpoint_stats = EndpointStats(window=int(os.getenv("TIMING_WINDOW", 1000)))
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault("timing_query_start", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timing = _current.get()
+    starts = conn.info.get("timing_query_start")
+    if timing is None or not starts:
+        return
+    timing.db += time.perf_counter() - starts.pop()
+    timing.queries += 1
+
+
+def _request_started(sender, **extra):
+    _current.set(RequestTiming())
+
+
+def _request_finished(sender, response, **extra):
+    timing = _current.get()
+    if timing is None:
+        return
+    _current.set(None)
+    total = time.perf_counter() - timing.started
+    rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+    endpoint_stats.record(f"{request.method} {rule}", timing, total)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = timing.header(total)
+
+
+def setup_timing(app):
+    request_started.connect(_request_started, app)
+    request_finished.connect(_request_finished, app)
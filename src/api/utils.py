@@ -1,4 +1,6 @@
 from flask import jsonify, url_for
+from datetime import datetime
+import base64
 import sys
 
 class APIException(Exception):
@@ -43,3 +45,18 @@ def generate_sitemap(app):
 
 def print_stderr(string):
     print(string, file=sys.stderr)
+
+
+def encode_cursor(created_at, id):
+    # Cursor opaco para la paginacion por (created_at, id)
+    raw = f"{created_at.isoformat()}|{id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, id = base64.urlsafe_b64decode(padded).decode().split("|")
+        return datetime.fromisoformat(created_at), int(id)
+    except (ValueError, UnicodeDecodeError):
+        raise APIException("Invalid cursor", status_code=400)
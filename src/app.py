@@ -2,35 +2,59 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for, send_from_directory, abort, redirect
+from flask import Flask, request, jsonify, url_for, abort, redirect, stream_with_context
 from flask_migrate import Migrate
-from flask_swagger import swagger
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
-from datetime import timedelta
-from api.utils import APIException, generate_sitemap, print_stderr
-from api.models import db, Product, User, Order, Favorite, OrderItem, prod_order, user_order, RoleEnum
+from werkzeug.exceptions import HTTPException
+from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt
+from functools import wraps
+from datetime import datetime, timedelta, timezone
+from api.utils import APIException, generate_sitemap, encode_cursor, decode_cursor
+from api.logs import setup_logging, log_payload, logger
+from api.models import db, dialect_insert, Product, User, Order, Favorite, OrderItem, prod_order, user_order, user_fav, prod_fav, RoleEnum, CategoryEnum
 from api.routes import api
 from api.admin import setup_admin
+from api.bulk import (bulk_insert, iter_json_array, parse_link_rows, missing_references,
+                      insert_links, BulkParseError)
+from api.search import search_terms, search_products
+from api.cache import (product_cache, catalog_version, cart_cache, cart_version,
+                       favorites_cache, favorites_version, identity_cache, identity_version,
+                       make_etag)
+from api.identity import setup_identity, identity_claims, current_identity
+from api.serializers import FastJSONProvider, dumps_bytes, user_serializer, product_serializer, order_item_serializer, order_serializer
 from api.commands import setup_commands
-from sqlalchemy import text, func
-import sys
-import traceback
-import stripe
+from api.timing import setup_timing, endpoint_stats
+from api.nplusone import setup_nplusone
+from api.replicas import replica_binds, replica_router, read_replica
+from api.metrics import setup_metrics, watch_cache, watch_pool, render as render_metrics
+from api.payments import (checkout_params, idempotency_key, start_checkout, parse_webhook,
+                          session_expires_at, CHECKOUT_MIN_HOLD_SECONDS)
+from api.reservations import reserve, release, confirm, OutOfStock
+from api.static_files import StaticManifest
+from sqlalchemy import func, tuple_, literal
 
 # from models import Person
 
-stripe.api_key = os.getenv('STRIPE_API_KEY')
-
 
 ENV = "development" if os.getenv("FLASK_DEBUG") == "1" else "production"
 static_file_dir = os.path.join(os.path.dirname(
     os.path.realpath(__file__)), '../dist/')
 app = Flask(__name__)
 app.url_map.strict_slashes = False
+# Indice en memoria de dist/ (se construye una vez al arrancar cada worker)
+static_files = StaticManifest(static_file_dir)
+app.json = FastJSONProvider(app)
+# Versiones compartidas sembradas al arrancar: nunca valen 0 (ver SharedVersion.seed)
+for version in (catalog_version, cart_version, favorites_version, identity_version):
+    version.seed()
+
+# Logs JSON en segundo plano con id de peticion (LOG_LEVEL, LOG_PAYLOAD_SAMPLE_RATE)
+setup_logging(app)
 
 app.config["JWT_SECRET_KEY"] = "super-secret-key"  # contrasena para los tokens
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(hours=1)
 jwt = JWTManager(app)
+# Usuario actual (current_identity()) de los endpoints con JWT, resuelto bajo demanda desde una cache (api/identity.py)
+setup_identity(jwt)
 
 # database condiguration
 db_url = os.getenv("DATABASE_URL")
@@ -41,58 +65,37 @@ else:
     app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Replicas de solo lectura opcionales (ver api/replicas.py)
+app.config['SQLALCHEMY_BINDS'] = replica_binds(os.getenv("DATABASE_REPLICA_URLS", ""))
 MIGRATE = Migrate(app, db, compare_type=True)
 db.init_app(app)
+replica_router.init_app(app, db)
 
-# add the admin
+# add the admin (en /admin, se carga en la primera peticion; ADMIN_MODE=off lo desactiva)
 setup_admin(app)
 
 # add the admin
 setup_commands(app)
 
+# Server-Timing y tiempos por endpoint (GET /timing/stats)
+setup_timing(app)
 
-def _reset_user_id_sequence_once():
-    if db.engine.url.get_backend_name() != "postgresql":
-        return
-    try:
-        db.session.execute(text("""
-            SELECT setval(
-              pg_get_serial_sequence('"user"', 'id'),
-              COALESCE((SELECT MAX(id) FROM "user"), 0),
-              true
-            );
-        """))
-        db.session.commit()
-        print("[SEQ] 'user'.id sequence reseteada ✅")
-    except Exception as e:
-        db.session.rollback()
-        print("[SEQ] No se pudo resetear la secuencia:", e)
-
+# Detector de consultas N+1 (config NPLUSONE: off, log o raise)
+setup_nplusone(app)
 
+# Metricas Prometheus (GET /metrics)
+setup_metrics(app)
+watch_cache("products", product_cache)
+watch_cache("carts", cart_cache)
+watch_cache("favorites", favorites_cache)
+watch_cache("identities", identity_cache)
 with app.app_context():
-    _reset_user_id_sequence_once()
-
-
-def _reset_user_id_sequence_once():
-    if db.engine.url.get_backend_name() != "postgresql":
-        return
-    try:
-        db.session.execute(text("""
-            SELECT setval(
-              pg_get_serial_sequence('"user"', 'id'),
-              COALESCE((SELECT MAX(id) FROM "user"), 0),
-              true
-            );
-        """))
-        db.session.commit()
-        print("[SEQ] 'user'.id sequence reseteada ✅")
-    except Exception as e:
-        db.session.rollback()
-        print("[SEQ] No se pudo resetear la secuencia:", e)
+    watch_pool("primary", db.engine)
+    for bind_key in replica_router.bind_keys:
+        watch_pool(bind_key, db.engines[bind_key])
 
-
-with app.app_context():
-    _reset_user_id_sequence_once()
+# Las tareas que tocan la base de datos (p.ej. resetear la secuencia de user.id) no se
+# ejecutan al importar: `flask run-startup-tasks` en el paso release (api/startup.py)
 
 # Add all endpoints form the API with a "api" prefix
 app.register_blueprint(api, url_prefix='/api')
@@ -104,6 +107,33 @@ app.register_blueprint(api, url_prefix='/api')
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
+
+def json_bytes(body, status=200):
+    # Respuesta JSON a partir de bytes ya serializados
+    return app.response_class(body, status=status, mimetype=app.json.mimetype)
+
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+NDJSON_CHUNK_SIZE = 1000
+
+
+def wants_ndjson():
+    return request.accept_mimetypes.best_match([app.json.mimetype, NDJSON_MIMETYPE]) == NDJSON_MIMETYPE
+
+
+def ndjson_stream(serializer, query):
+    """
+    Exporta una tabla como NDJSON (una fila por linea) usando un cursor de servidor:
+    las filas se leen por bloques de NDJSON_CHUNK_SIZE, asi la memoria no crece con la tabla.
+    """
+    def generate():
+        result = db.session.execute(query.execution_options(yield_per=NDJSON_CHUNK_SIZE))
+        for rows in result.partitions():
+            yield b"".join(serializer.dumps_one(row) + b"\n" for row in rows)
+
+    return app.response_class(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
 # generate sitemap with all your endpoints
 
 
@@ -111,56 +141,63 @@ def handle_invalid_usage(error):
 def sitemap():
     if ENV == "development":
         return generate_sitemap(app)
-    return send_from_directory(static_file_dir, 'index.html')
+    return static_files.send('index.html')
 
 # any other endpoint will try to serve it like a static file
 
 
 @app.route('/<path:path>', methods=['GET'])
 def serve_any_other_file(path):
-    if not os.path.isfile(os.path.join(static_file_dir, path)):
-        path = 'index.html'
-    response = send_from_directory(static_file_dir, path)
-    response.cache_control.max_age = 0  # avoid cache memory
-    return response
+    return static_files.send(path)
 
 
 @app.route('/users', methods=['GET'])
 def get_users():
+    if wants_ndjson():
+        return ndjson_stream(user_serializer, user_serializer.select().order_by(User.id))
     try:
-        users = db.session.execute(db.select(User)).scalars().all()
-        print("all users: ", users)
+        users = db.session.execute(user_serializer.select()).all()
+        log_payload("all users", users)
         if not users:
             abort(404, description="User not found")
-        result = [user.serialize() for user in users]
-        return jsonify(result), 200
+        return json_bytes(user_serializer.dumps(users)), 200
 
     except Exception as e:
         raise APIException(str(e), status_code=500)
 
 
-@app.route('/users', methods=['POST'])
-def add_users():
+def _bulk_insert_request(model, serializer):
+    # Inserta el array JSON del cuerpo leyendolo en streaming, con errores por fila
     try:
-        users = request.get_json()
-        print("Request body: ", users)
-        new_users = [User(**user) for user in users]
-
-        db.session.add_all(new_users)
+        created, errors = bulk_insert(model, serializer, iter_json_array(request.stream))
         db.session.commit()
-
-        serialized_users = [user.serialize() for user in new_users]
-
-        return jsonify(serialized_users), 201
+        return created, errors
+    except BulkParseError as e:
+        db.session.rollback()
+        raise APIException(str(e), status_code=400)
     except Exception as e:
         db.session.rollback()
         raise APIException(str(e), status_code=500)
 
+
+def _bulk_response(created, errors):
+    if not errors:
+        return jsonify(created), 201
+    status = 207 if created else 400
+    return jsonify({"created": created, "errors": errors}), status
+
+
+@app.route('/users', methods=['POST'])
+def add_users():
+    created, errors = _bulk_insert_request(User, user_serializer)
+    return _bulk_response(created, errors)
+
+
 @app.route('/product', methods=['POST'])
 def add_product():
     try:
         product_data = request.get_json()
-        print("Request body: ", product_data)
+        log_payload("Request body", product_data)
         form = product_data.get("form", None)   
         user_id = product_data.get("user_id", None)   
         img = product_data.get("img", None)   
@@ -180,11 +217,12 @@ def add_product():
             abort(404, f"User with id={user_id} not found.")
 
         new_product = Product(**form, artist_id=user_id, img_path=img.get("img_path"), discount=0)
-        print("New product: ", new_product)
+        log_payload("New product", form)
         db.session.add(new_product)
         db.session.flush()
         user.products.append(new_product)
         db.session.commit()
+        catalog_version.bump()
 
         serialized_product = new_product.serialize()
 
@@ -195,75 +233,107 @@ def add_product():
 
 @app.route('/products', methods=['POST'])
 def add_products():
-    try:
-        products = request.get_json()
-        print("Request body: ", products)
-        new_prods = [Product(**prod) for prod in products]
-
-        db.session.add_all(new_prods)
-        db.session.commit()
-
-        serialized_prods = [prod.serialize() for prod in new_prods]
-
-        return jsonify(serialized_prods), 201
-
-    except Exception as e:
-        db.session.rollback()
-        raise APIException(str(e), status_code=500)
+    created, errors = _bulk_insert_request(Product, product_serializer)
+    catalog_version.bump()
+    return _bulk_response(created, errors)
 
 
 @app.route('/orders', methods=['GET'])
+@read_replica(cart_version)
 def get_all_orders():
+    if wants_ndjson():
+        return ndjson_stream(order_serializer, order_serializer.select().order_by(Order.id))
     try:
-        orders = db.session.execute(db.select(Order)).scalars().all()
-        print("all users: ", orders)
+        orders = db.session.execute(order_serializer.select()).all()
+        log_payload("all orders", orders)
         if not orders:
             abort(404, description="User not found")
-        result = [order.serialize() for order in orders]
-        return jsonify(result), 200
+        return json_bytes(order_serializer.dumps(orders)), 200
 
     except Exception as e:
         raise APIException(str(e), status_code=500)
 
 
-@app.route('/my-cart/<int:user_id>', methods=['GET'])
-def get_orders(user_id):
-    try:
+def _load_cart(user_id):
+    # Una sola consulta que proyecta solo las columnas necesarias, sin hidratar entidades
+    rows = db.session.execute(
+        db.select(user_order.c.order_id, OrderItem.id, OrderItem.quantity,
+                  *product_serializer.columns)
+        .select_from(user_order)
+        .join(OrderItem, OrderItem.order_id == user_order.c.order_id)
+        .join(Product, Product.id == OrderItem.prod_id)
+        .where(user_order.c.user_id == user_id, user_order.c.is_open)
+        .order_by(user_order.c.order_id, OrderItem.id)).all()
 
-        results = db.session.execute(
-            db.select(Order, User, Product, OrderItem)
-            .join(Order.users)
-            .where(User.id == user_id)
-            .join(Order.items)
-            .join(OrderItem.product)).all()
+    orders_dict = {}
+    seen = set()
+    for row in rows:
+        order_id, order_item_id, quantity = row[0], row[1], row[2]
+        product = product_serializer.to_dict(row[3:])
 
-        orders_dict = {}
-        for order, _, prod, order_item in results:
+        if (order_id, product["id"]) in seen:
+            continue
+        seen.add((order_id, product["id"]))
 
-            order_item_id = order_item.id
-            quantity = order_item.quantity
+        if order_id not in orders_dict:
+            orders_dict[order_id] = {"id": order_id, "products": []}
 
-            if order.id not in orders_dict:
-                order_info = order.serialize()
-                order_info['products'] = []
-                orders_dict[order.id] = order_info
+        orders_dict[order_id]["products"].append({
+            "item_id": order_item_id,
+            "quantity_ordered": quantity,
+            "product_details": product
+        })
 
-            if any(p["product_details"]["id"] == prod.id for p in orders_dict[order.id]["products"]):
-                continue
-
-            orders_dict[order.id]['products'].append({
-                "item_id": order_item_id,
-                "quantity_ordered": quantity,
-                "product_details": prod.serialize()
-            })
+    return dumps_bytes(list(orders_dict.values()))
 
-        list_orders = list(orders_dict.values())
 
-        return list_orders, 200
+@app.route('/my-cart/<int:user_id>', methods=['GET'])
+def get_orders(user_id):
+    try:
+        # El carrito incluye datos del producto, asi que depende tambien de la version del catalogo
+        cache_key = (user_id, cart_version.current_for(user_id), catalog_version.current())
+        body = cart_cache.get(cache_key)
+        if body is None:
+            body = _load_cart(user_id)
+            cart_cache.set(cache_key, body)
+
+        return json_bytes(body), 200
     except Exception as e:
         raise APIException(str(e), status_code=500)
 
 
+def _find_cart(user_id):
+    # Id del pedido abierto (carrito) del usuario, o None si no tiene. Los pagados son historico
+    return db.session.execute(
+        db.select(user_order.c.order_id)
+        .join(Order, Order.id == user_order.c.order_id)
+        .where(user_order.c.user_id == user_id, user_order.c.is_open, Order.paid_at.is_(None))
+    ).scalar()
+
+
+def _get_or_create_cart(user_id):
+    # Devuelve el id del pedido abierto (carrito) del usuario, creandolo si no existe
+    order_id = _find_cart(user_id)
+    if order_id is not None:
+        return order_id
+
+    if db.session.get(User, user_id) is None:
+        abort(404, f"User with id={user_id} not found.")
+    order = Order()
+    db.session.add(order)
+    db.session.flush()
+    linked = db.session.execute(
+        dialect_insert(user_order)
+        .values(user_id=user_id, order_id=order.id)
+        .on_conflict_do_nothing()).rowcount
+    if linked:
+        return order.id
+
+    # Otra peticion concurrente ya creo el carrito de este usuario: usamos ese
+    db.session.delete(order)
+    return _find_cart(user_id)
+
+
 @app.route('/my-cart', methods=['POST'])
 def add_item_to_cart():
     try:
@@ -279,65 +349,51 @@ def add_item_to_cart():
         if not user or "id" not in user:
             abort(400, "Invalid user data")
 
-        user = db.session.execute(
-            db.select(User).where(User.id == user["id"])
-        ).scalar_one_or_none()
-        if not user:
-            abort(404, f"User with id={user['id']} not found.")
+        user_id = user["id"]
+        prod_id = item["id"]
+
+        order_id = _get_or_create_cart(user_id)
+
+        # Upsert de la linea con el control de stock en la misma sentencia:
+        # solo se inserta/incrementa si la nueva cantidad no supera Product.amount
+        order_items = OrderItem.__table__
+        stock = db.select(Product.amount).where(Product.id == prod_id).scalar_subquery()
+        upsert = (
+            dialect_insert(order_items)
+            .from_select(
+                ["order_id", "prod_id", "quantity"],
+                db.select(literal(order_id), literal(prod_id), literal(1))
+                .where(Product.id == prod_id, Product.amount >= 1))
+            .on_conflict_do_update(
+                index_elements=["order_id", "prod_id"],
+                set_={"quantity": order_items.c.quantity + 1},
+                where=order_items.c.quantity < stock)
+            .returning(order_items.c.quantity, stock)
+        )
+        result = db.session.execute(upsert).first()
 
-        product = db.session.execute(
-            db.select(Product).where(Product.id == item["id"])
-        ).scalar_one_or_none()
-        if not product:
-            abort(404, f"Product with id={item['id']} not found.")
-
-        order = db.session.execute(
-            db.select(Order)
-            .join(Order.users)
-            .where(User.id == user.id)
-        ).scalar_one_or_none()
-
-        if not order:
-            order = Order()
-            db.session.add(order)
-            user.orders.append(order)
-            product.orders.append(order)
-            db.session.flush()
-
-        existing_item = db.session.execute(
-            db.select(OrderItem)
-            .where(OrderItem.order_id == order.id)
-            .where(OrderItem.prod_id == product.id)
-        ).scalar_one_or_none()
-
-        quantity = 1
-
-        if existing_item is None:
-            order_item = OrderItem(
-                order_id=order.id,
-                prod_id=item["id"],
-                quantity=quantity
-            )
-            order.products.append(product)
-            db.session.add(order_item)
-        else:
-            quantity = existing_item.quantity + 1
-            db.session.execute(
-                db.update(OrderItem)
-                .where(OrderItem.id == existing_item.id)
-                .values(quantity=quantity)
-            )
-        if quantity > product.amount:
+        if result is None:
+            db.session.rollback()
+            if db.session.get(Product, prod_id) is None:
+                abort(404, f"Product with id={prod_id} not found.")
             return jsonify({"message": "Aborted, there are not that amount of products in stock."})
 
+        quantity, amount = result
+        if quantity == 1:
+            db.session.execute(
+                dialect_insert(prod_order)
+                .values(prod_id=prod_id, order_id=order_id)
+                .on_conflict_do_nothing())
+
         db.session.commit()
+        cart_version.bump_user(user_id)
 
         return jsonify({
             "message": "Producto añadido al carrito correctamente.",
-            "order_id": order.id,
-            "prod_id": product.id,
+            "order_id": order_id,
+            "prod_id": prod_id,
             "quantity": quantity,
-            "stock": product.amount
+            "stock": amount
         }), 201
 
     except Exception as e:
@@ -345,13 +401,140 @@ def add_item_to_cart():
         return jsonify({"message": str(e)}), 500
 
 
+CART_BATCH_OPS = ("add", "set", "remove")
+
+
+def _parse_cart_operations(operations):
+    if not isinstance(operations, list) or not operations:
+        raise APIException("'operations' must be a non-empty list", status_code=400)
+    parsed = []
+    for index, operation in enumerate(operations):
+        op = operation.get("op") if isinstance(operation, dict) else None
+        if op not in CART_BATCH_OPS:
+            raise APIException(f"Operation {index}: 'op' must be one of {', '.join(CART_BATCH_OPS)}",
+                               status_code=400)
+        try:
+            prod_id = int(operation["prod_id"])
+            quantity = int(operation.get("quantity", 1 if op == "add" else 0))
+        except (KeyError, TypeError, ValueError):
+            raise APIException(f"Operation {index}: invalid 'prod_id' or 'quantity'", status_code=400)
+        if quantity < 0 or (op == "set" and "quantity" not in operation):
+            raise APIException(f"Operation {index}: invalid 'quantity'", status_code=400)
+        parsed.append((op, prod_id, quantity))
+    return parsed
+
+
+@app.route('/my-cart/batch', methods=['POST'])
+def batch_update_cart():
+    """
+    Aplica varias operaciones sobre el carrito de un usuario en una sola transaccion:
+    {"currentUser": {"id": 1}, "operations": [{"op": "add", "prod_id": 3, "quantity": 2},
+    {"op": "set", "prod_id": 4, "quantity": 1}, {"op": "remove", "prod_id": 5}]}
+    Devuelve el carrito resultante con el mismo formato que GET /my-cart/<user_id>.
+    """
+    request_body = request.get_json(silent=True) or {}
+    user = request_body.get("currentUser")
+    if not user or "id" not in user:
+        raise APIException("Invalid user data", status_code=400)
+    user_id = user["id"]
+    operations = _parse_cart_operations(request_body.get("operations"))
+
+    try:
+        if any(op != "remove" for op, prod_id, quantity in operations):
+            order_id = _get_or_create_cart(user_id)
+        else:
+            # Solo se quitan productos: no se crea un carrito vacio si el usuario no tiene
+            order_id = _find_cart(user_id)
+            if order_id is None:
+                if db.session.get(User, user_id) is None:
+                    abort(404, f"User with id={user_id} not found.")
+                return json_bytes(_load_cart(user_id)), 200
+        order_items = OrderItem.__table__
+
+        current = dict(db.session.execute(
+            db.select(OrderItem.prod_id, OrderItem.quantity)
+            .where(OrderItem.order_id == order_id)).all())
+
+        # Se calcula el estado final de cada linea y luego se escribe con sentencias masivas
+        wanted = dict(current)
+        for op, prod_id, quantity in operations:
+            if op == "add":
+                wanted[prod_id] = wanted.get(prod_id, 0) + quantity
+            elif op == "set":
+                wanted[prod_id] = quantity
+            else:
+                wanted[prod_id] = 0
+
+        changed = {prod_id: quantity for prod_id, quantity in wanted.items()
+                   if current.get(prod_id, 0) != quantity}
+        stock = dict(db.session.execute(
+            db.select(Product.id, Product.amount)
+            .where(Product.id.in_([prod_id for prod_id, quantity in changed.items() if quantity > 0]))).all())
+
+        errors = []
+        for prod_id, quantity in changed.items():
+            if quantity == 0:
+                continue
+            if prod_id not in stock:
+                errors.append({"prod_id": prod_id, "message": f"Product with id={prod_id} not found."})
+            elif quantity > stock[prod_id]:
+                errors.append({"prod_id": prod_id, "message": "There are not that amount of products in stock.",
+                               "requested": quantity, "stock": stock[prod_id]})
+        if errors:
+            raise APIException("Aborted, cart not updated.", status_code=409, payload={"errors": errors})
+
+        upserts = [{"order_id": order_id, "prod_id": prod_id, "quantity": quantity}
+                   for prod_id, quantity in changed.items() if quantity > 0]
+        removed = [prod_id for prod_id, quantity in changed.items() if quantity == 0 and prod_id in current]
+        added = [{"prod_id": prod_id, "order_id": order_id}
+                 for prod_id, quantity in changed.items() if quantity > 0 and prod_id not in current]
+
+        if upserts:
+            upsert = dialect_insert(order_items).values(upserts)
+            db.session.execute(upsert.on_conflict_do_update(
+                index_elements=["order_id", "prod_id"],
+                set_={"quantity": upsert.excluded.quantity}))
+        if added:
+            db.session.execute(dialect_insert(prod_order).values(added).on_conflict_do_nothing())
+        if removed:
+            db.session.execute(db.delete(OrderItem).where(
+                OrderItem.order_id == order_id, OrderItem.prod_id.in_(removed)))
+            db.session.execute(db.delete(prod_order).where(
+                prod_order.c.order_id == order_id, prod_order.c.prod_id.in_(removed)))
+
+        # Igual que al borrar el ultimo producto: un carrito vacio no se guarda
+        if not any(quantity > 0 for quantity in wanted.values()):
+            db.session.execute(db.delete(prod_order).where(prod_order.c.order_id == order_id))
+            db.session.execute(db.delete(user_order).where(user_order.c.order_id == order_id))
+            db.session.execute(db.delete(Order).where(Order.id == order_id))
+
+        db.session.commit()
+        cart_version.bump_user(user_id)
+
+        return json_bytes(_load_cart(user_id)), 200
+
+    except (APIException, HTTPException):
+        db.session.rollback()
+        raise
+    except Exception as e:
+        db.session.rollback()
+        raise APIException(str(e), status_code=500)
+
+
 @app.route('/my-cart', methods=['PUT'])
 def update_amount():
     try:
         request_body = request.get_json()
         order_item_id = request_body.get("order_item_id")
         quantity = request_body.get("counter")
+        user_id = db.session.execute(
+            db.select(user_order.c.user_id)
+            .join(OrderItem, OrderItem.order_id == user_order.c.order_id)
+            .where(OrderItem.id == order_item_id, user_order.c.is_open)).scalar()
 
+        # Solo lineas del carrito abierto: las de un pedido ya pagado no se modifican
+        if user_id is None:
+            abort(404, f"Order_item id = ${order_item_id} not found!")
         db.session.execute(
             db.update(OrderItem)
             .where(OrderItem.id == order_item_id)
@@ -359,6 +542,7 @@ def update_amount():
         )
 
         db.session.commit()
+        cart_version.bump_user(user_id)
 
         result = db.session.execute(db.select(OrderItem).where(
             OrderItem.id == order_item_id)).scalar_one_or_none()
@@ -366,6 +550,8 @@ def update_amount():
         result = result.serialize()
 
         return jsonify({"message": "Amount updated", "result": result})
+    except HTTPException:
+        raise
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -381,8 +567,8 @@ def delete_prod_from_cart(prod_id):
         user = db.session.execute(db.select(User).where(
             User.id == current_user["id"])).scalar_one_or_none()
 
-        order = db.session.execute(db.select(Order).join(
-            Order.users).where(User.id == current_user["id"])).scalar_one_or_none()
+        order_id = _find_cart(current_user["id"])
+        order = db.session.get(Order, order_id) if order_id is not None else None
         if order is None:
             abort(404, f'Order does not have a record with user_id = {current_user["id"]}.')
         order_item = db.session.execute(db.select(OrderItem).where(
@@ -404,6 +590,7 @@ def delete_prod_from_cart(prod_id):
             db.session.delete(order_item)
 
         db.session.commit()
+        cart_version.bump_user(current_user["id"])
 
         return jsonify({"message": "Delete completed!"}), 200
     except Exception as e:
@@ -412,32 +599,21 @@ def delete_prod_from_cart(prod_id):
 
 @app.route('/orders', methods=['POST'])
 def add_orders():
-    try:
-        orders = request.get_json()
-        print("Request body: ", orders)
-        new_orders = [Order(**order) for order in orders]
-
-        db.session.add_all(new_orders)
-        db.session.commit()
-
-        serialized_orders = [order.serialize() for order in new_orders]
-
-        return jsonify(serialized_orders), 201
-
-    except Exception as e:
-        db.session.rollback()
-        raise APIException(str(e), status_code=500)
+    created, errors = _bulk_insert_request(Order, order_serializer)
+    cart_version.bump_all()
+    return _bulk_response(created, errors)
 
 
 @app.route('/order_items', methods=['GET'])
 def get_order_items():
+    if wants_ndjson():
+        return ndjson_stream(order_item_serializer, order_item_serializer.select().order_by(OrderItem.id))
     try:
-        items = db.session.execute(db.select(OrderItem)).scalars().all()
-        print_stderr(f"all users: ${items}")
+        items = db.session.execute(order_item_serializer.select()).all()
+        log_payload("all order items", items)
         if not items:
             abort(404, description="Item not found")
-        result = [item.serialize() for item in items]
-        return jsonify(result), 200
+        return json_bytes(order_item_serializer.dumps(items)), 200
 
     except Exception as e:
         raise APIException(str(e), status_code=500)
@@ -445,18 +621,43 @@ def get_order_items():
 
 @app.route('/order_items', methods=['POST'])
 def add_order_items():
+    created, errors = _bulk_insert_request(OrderItem, order_item_serializer)
+    cart_version.bump_all()
+    return _bulk_response(created, errors)
+
+
+def _link_request(table, references):
+    """
+    Rellena una tabla de enlace con el array JSON del cuerpo: valida todos los ids
+    con una consulta IN por entidad y los inserta con un INSERT multi-fila,
+    saltando los enlaces que ya existen.
+    Devuelve (enlaces creados, errores por fila) de los que chocan con otro indice unico.
+    """
+    rows = request.get_json(silent=True)
+    keys = tuple(references)
     try:
-        items = request.get_json()
-        print("Request body: ", items)
-        new_items = [OrderItem(**item) for item in items]
+        links = parse_link_rows(rows, keys)
+    except BulkParseError as e:
+        raise APIException(str(e), status_code=400)
 
-        db.session.add_all(new_items)
+    try:
+        missing = missing_references(links, references)
+        if missing:
+            raise APIException("Item not found", status_code=404, payload={"missing": missing})
+        created, rejected = insert_links(table, links)
         db.session.commit()
-
-        serialized_items = [item.serialize() for item in new_items]
-
-        return jsonify(serialized_items), 201
-
+        # Indice de la primera aparicion de cada enlace en la entrada
+        first = {}
+        for index, row in enumerate(rows):
+            first.setdefault(tuple(row[key] for key in keys), index)
+        errors = [{"index": first[tuple(link[key] for key in keys)],
+                   "message": f"{', '.join(f'{key}={link[key]}' for key in keys)} conflicts with an existing row"}
+                  for link in rejected]
+        errors.sort(key=lambda error: error["index"])
+        return created, errors
+    except APIException:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         raise APIException(str(e), status_code=500)
@@ -464,55 +665,27 @@ def add_order_items():
 
 @app.route('/prod_order', methods=['POST'])
 def add_prod_orders():
-    try:
-        prod_orders = request.get_json()
-        print("Request body: ", prod_orders)
-
-        for row in prod_orders:
-            order = db.session.get(Order, row["order_id"])
-            product = db.session.get(Product, row["prod_id"])
-            if not order or not product:
-                abort(404, description="Item not found")
-
-            order.products.append(product)
-
-        db.session.commit()
-
-        return "prod_order filled successfully.", 201
-
-    except Exception as e:
-        db.session.rollback()
-        raise APIException(str(e), status_code=500)
+    created, errors = _link_request(prod_order, {"prod_id": Product, "order_id": Order})
+    cart_version.bump_all()
+    if errors:
+        return _bulk_response(created, errors)
+    return "prod_order filled successfully.", 201
 
 
 @app.route('/user_order', methods=['POST'])
 def add_user_orders():
-    try:
-        user_orders = request.get_json()
-        print("Request body: ", user_orders)
-
-        for row in user_orders:
-            order = db.session.get(Order, row["order_id"])
-            user = db.session.get(User, row["user_id"])
-            if not order or not user:
-                abort(404, description="Item not found")
-
-            order.users.append(user)
-
-        db.session.commit()
-
-        return "user_order filled successfully.", 201
-
-    except Exception as e:
-        db.session.rollback()
-        raise APIException(str(e), status_code=500)
+    created, errors = _link_request(user_order, {"user_id": User, "order_id": Order})
+    cart_version.bump_all()
+    if errors:
+        return _bulk_response(created, errors)
+    return "user_order filled successfully.", 201
 
 
 @app.route('/favorites', methods=['POST'])
 def add_favorites():
     try:
         favorites = request.get_json()
-        print("Request body: ", favorites)
+        log_payload("Request body", favorites)
         new_favorites = [Favorite(**fav) for fav in favorites]
 
         db.session.add_all(new_favorites)
@@ -530,72 +703,52 @@ def add_favorites():
 @app.route('/user_prod', methods=['POST'])
 def add_user_prods():
     try:
-        user_prod = request.get_json()
-        print("Request body: ", user_prod)
-
-        for row in user_prod:
-            prod = db.session.get(Product, row["prod_id"])
-            user = db.session.get(User, row["user_id"])
-            if not prod or not user:
-                abort(404, description="Item not found")
-
-            user.products.append(prod)
+        links = parse_link_rows(request.get_json(silent=True), ("user_id", "prod_id"))
+    except BulkParseError as e:
+        raise APIException(str(e), status_code=400)
 
+    try:
+        missing = missing_references(links, {"user_id": User, "prod_id": Product})
+        if missing:
+            raise APIException("Item not found", status_code=404, payload={"missing": missing})
+
+        # El "enlace" usuario-producto es Product.artist_id: UPDATE masivo por clave primaria
+        if links:
+            db.session.execute(db.update(Product), [
+                {"id": link["prod_id"], "artist_id": link["user_id"]} for link in links])
         db.session.commit()
+        catalog_version.bump()
 
         return "user_prod filled successfully.", 201
 
+    except APIException:
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
         raise APIException(str(e), status_code=500)
-    
-@app.route('/user_favs', methods=['POST'])
-def add_user_favs():
-    try:
-        user_fav = request.get_json()
-        print("Request body: ", user_fav)
-
-        for row in user_fav:
-            fav = db.session.get(Favorite, row["fav_id"])
-            user = db.session.get(User, row["user_id"])
-            if not fav or not user:
-                abort(404, description="Item not found")
-
-            fav.users.append(user)
-
-        db.session.commit()
 
-        return "user_fav filled successfully.", 201
 
-    except Exception as e:
-        db.session.rollback()
-        raise APIException(str(e), status_code=500)
+@app.route('/user_favs', methods=['POST'])
+def add_user_favs():
+    created, errors = _link_request(user_fav, {"user_id": User, "fav_id": Favorite})
+    favorites_version.bump_all()
+    if errors:
+        return _bulk_response(created, errors)
+    return "user_fav filled successfully.", 201
 
 
 @app.route('/prod_favs', methods=['POST'])
 def add_prod_favs():
-    try:
-        prod_fav = request.get_json()
-        print("Request body: ", prod_fav)
-
-        for row in prod_fav:
-            fav = db.session.get(Favorite, row["fav_id"])
-            prod = db.session.get(Product, row["prod_id"])
-            if not fav or not prod:
-                abort(404, description="Item not found")
-
-            fav.products.append(prod)
-
-        db.session.commit()
-
-        return "user_fav filled successfully.", 201
-
-    except Exception as e:
-        db.session.rollback()
-        raise APIException(str(e), status_code=500)
+    created, errors = _link_request(prod_fav, {"prod_id": Product, "fav_id": Favorite})
+    favorites_version.bump_all()
+    if errors:
+        return _bulk_response(created, errors)
+    return "user_fav filled successfully.", 201
 
 
 @app.route('/my-favorites/<int:user_id>', methods=['GET'])
+@read_replica(favorites_version)
 def get_favs(user_id):
     try:
         favorites = db.session.execute(
@@ -630,35 +783,74 @@ def add_fav():
         current_user = request_body.get("currentUser")
         if not current_user:
             abort(404, "Current user not found.")
-
-        favorite = db.session.execute(
-            db.select(Favorite)
-            .join(Favorite.users)
-            .join(Favorite.products)
-            .where(Product.id == prod_id)
-            .where(User.id == current_user["id"])).scalar_one_or_none()
-        user = db.session.execute(db.select(User).where(
-            User.id == current_user["id"])).scalar_one_or_none()
-        product = db.session.execute(db.select(Product).where(
-            Product.id == prod_id)).scalar_one_or_none()
-
-        if favorite is None:
-            fav = Favorite()
-            user.favorites.append(fav)
-            product.favorites.append(fav)
-            db.session.add(fav)
-            db.session.flush()
-
-        else:
-            favorite.products.append(product)
+        # Ids numericos como texto ("3") se aceptan, como antes
+        try:
+            prod_id = int(prod_id)
+            user_id = int(current_user["id"])
+        except (KeyError, TypeError, ValueError):
+            raise APIException("'prod_id' and 'currentUser.id' must be integers", status_code=400)
+        current_user = {**current_user, "id": user_id}
+
+        if prod_id in _favorite_product_ids(current_user["id"]):
+            # Ya es favorito: la tabla prod_fav no admite duplicados
+            return jsonify({"message": "Fav added successfully."})
+        missing = missing_references([{"user_id": current_user["id"], "prod_id": prod_id}],
+                                     {"user_id": User, "prod_id": Product})
+        if missing:
+            abort(404, f"Item not found: {missing}")
+
+        # Se insertan los enlaces directamente, sin cargar las colecciones user.favorites/product.favorites
+        fav = Favorite()
+        db.session.add(fav)
+        db.session.flush()
+        db.session.execute(db.insert(user_fav).values(user_id=current_user["id"], fav_id=fav.id))
+        db.session.execute(db.insert(prod_fav).values(prod_id=prod_id, fav_id=fav.id))
 
         db.session.commit()
+        favorites_version.bump_user(current_user["id"])
 
         return jsonify({"message": "Fav added successfully."})
 
+    except (APIException, HTTPException):
+        db.session.rollback()
+        raise
     except Exception as e:
         db.session.rollback()
-        raise APIException(jsonify(e), status_code=500)
+        raise APIException(str(e), status_code=500)
+
+
+def _favorite_product_ids(user_id):
+    cache_key = (user_id, favorites_version.current_for(user_id))
+    prod_ids = favorites_cache.get(cache_key)
+    if prod_ids is None:
+        prod_ids = frozenset(db.session.execute(
+            db.select(prod_fav.c.prod_id)
+            .join(user_fav, user_fav.c.fav_id == prod_fav.c.fav_id)
+            .where(user_fav.c.user_id == user_id)).scalars())
+        favorites_cache.set(cache_key, prod_ids)
+    return prod_ids
+
+
+@app.route('/my-favorites/contains', methods=['POST'])
+def favorites_contains():
+    """
+    Indica que productos de una lista son favoritos del usuario, sin devolver los productos:
+    {"currentUser": {"id": 1}, "prod_ids": [3, 5, 8]} -> {"prod_ids": [3, 5, 8], "contains": [true, false, true]}
+    """
+    request_body = request.get_json(silent=True) or {}
+    current_user = request_body.get("currentUser")
+    if not current_user or "id" not in current_user:
+        raise APIException("Current user not found.", status_code=400)
+    prod_ids = request_body.get("prod_ids")
+    if not isinstance(prod_ids, list) or not all(isinstance(prod_id, int) for prod_id in prod_ids):
+        raise APIException("'prod_ids' must be a list of integers", status_code=400)
+
+    try:
+        favorites = _favorite_product_ids(current_user["id"])
+        return jsonify({"prod_ids": prod_ids,
+                        "contains": [prod_id in favorites for prod_id in prod_ids]}), 200
+    except Exception as e:
+        raise APIException(str(e), status_code=500)
 
 
 @app.route('/my-favorites/<int:prod_id>', methods=['DELETE'])
@@ -666,25 +858,22 @@ def delete_fav(prod_id):
     try:
         current_user = request.get_json().get('currentUser')
 
-        user = db.session.execute(db.select(User).where(
-            User.id == current_user["id"])).scalar_one_or_none()
-        product = db.session.execute(db.select(Product).where(
-            Product.id == prod_id)).scalar_one_or_none()
-        favorite = db.session.execute(
-            db.select(Favorite)
-            .join(Favorite.products)
-            .join(Favorite.users)
-            .where(User.id == current_user["id"])
-            .where(Product.id == prod_id)).scalar_one_or_none()
+        fav_ids = db.session.execute(
+            db.select(user_fav.c.fav_id)
+            .join(prod_fav, prod_fav.c.fav_id == user_fav.c.fav_id)
+            .where(user_fav.c.user_id == current_user["id"])
+            .where(prod_fav.c.prod_id == prod_id)).scalars().all()
 
-        if favorite is None:
+        if not fav_ids:
             abort(
                 404, f"Favorite with prod_id = ${prod_id} and user_id = ${current_user['id']} not found.")
 
-        favorite.users.remove(user)
-        favorite.products.remove(product)
-        db.session.delete(favorite)
+        # Borrado directo de los enlaces y del favorito, sin cargar favorite.users/favorite.products
+        db.session.execute(db.delete(user_fav).where(user_fav.c.fav_id.in_(fav_ids)))
+        db.session.execute(db.delete(prod_fav).where(prod_fav.c.fav_id.in_(fav_ids)))
+        db.session.execute(db.delete(Favorite).where(Favorite.id.in_(fav_ids)))
         db.session.commit()
+        favorites_version.bump_user(current_user["id"])
 
         return jsonify({"message": "Fav deleted successfully."})
 
@@ -694,32 +883,224 @@ def delete_fav(prod_id):
 
 
 
+PRODUCTS_PAGE_SIZE = 24
+PRODUCTS_MAX_PAGE_SIZE = 100
+
+
+def _int_arg(name, default=None):
+    value = request.args.get(name)
+    if value is None or value == "":
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise APIException(f"Query param '{name}' must be an integer", status_code=400)
+
+
+def _products_query():
+    # Filtros del catalogo + paginacion por cursor sobre (created_at, id), del mas nuevo al mas viejo
+    query = product_serializer.select()
+
+    category = request.args.get("category")
+    if category:
+        try:
+            query = query.where(Product.category == CategoryEnum(category.lower()))
+        except ValueError:
+            raise APIException(f"Unknown category '{category}'", status_code=400)
+
+    min_price = _int_arg("min_price")
+    if min_price is not None:
+        query = query.where(Product.price >= min_price)
+    max_price = _int_arg("max_price")
+    if max_price is not None:
+        query = query.where(Product.price <= max_price)
+
+    artist_id = _int_arg("artist_id")
+    if artist_id is not None:
+        query = query.where(Product.artist_id == artist_id)
+
+    if request.args.get("in_stock", "").lower() in ("1", "true", "yes"):
+        query = query.where(Product.amount > 0)
+
+    cursor = request.args.get("cursor")
+    if cursor:
+        created_at, last_id = decode_cursor(cursor)
+        query = query.where(
+            tuple_(Product.created_at, Product.id) < tuple_(created_at, last_id))
+
+    return query.order_by(Product.created_at.desc(), Product.id.desc())
+
+
+def _catalog_response(key, load):
+    """
+    Sirve una lectura del catalogo desde product_cache. La clave incluye la version
+    del catalogo, asi que cualquier escritura invalida todo lo cacheado de golpe.
+    Si el cliente ya tiene la misma version (If-None-Match) se responde 304 sin tocar la DB.
+    """
+    version = catalog_version.current()
+    etag = make_etag(version, key)
+    if request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.set_etag(etag)
+        return response
+
+    cache_key = (version, key)
+    cached = product_cache.get(cache_key)
+    if cached is None:
+        cached = load()
+        product_cache.set(cache_key, cached)
+
+    body, headers = cached
+    response = json_bytes(body)
+    response.headers.extend(headers)
+    response.set_etag(etag)
+    return response
+
+
 @app.route('/products', methods=['GET'])
+@read_replica(catalog_version)
 def get_products():
+    limit = _int_arg("limit", PRODUCTS_PAGE_SIZE)
+    if limit < 1:
+        raise APIException("Query param 'limit' must be positive", status_code=400)
+    limit = min(limit, PRODUCTS_MAX_PAGE_SIZE)
+    query = _products_query().limit(limit + 1)
+
+    def load():
+        products = db.session.execute(query).all()
+        headers = {}
+        # El siguiente cursor va en la cabecera para que el cuerpo siga siendo una lista
+        if len(products) > limit:
+            last = products[limit - 1]
+            headers["X-Next-Cursor"] = encode_cursor(last.created_at, last.id)
+        return product_serializer.dumps(products[:limit]), headers
+
     try:
-        products = db.session.execute(db.select(Product)).scalars().all()
-        return jsonify([product.serialize() for product in products]), 200
+        key = "products?" + "&".join(sorted(f"{k}={v}" for k, v in request.args.items(multi=True)))
+        return _catalog_response(key, load)
+    except Exception as e:
+        raise APIException(str(e), status_code=500)
+
+
+@app.route('/products/search', methods=['GET'])
+def search_catalog():
+    terms = search_terms(request.args.get("q"))
+    if not terms:
+        raise APIException("Query param 'q' is required", status_code=400)
+
+    category = request.args.get("category")
+    if category:
+        try:
+            category = CategoryEnum(category.lower())
+        except ValueError:
+            raise APIException(f"Unknown category '{category}'", status_code=400)
+
+    limit = min(_int_arg("limit", PRODUCTS_PAGE_SIZE), PRODUCTS_MAX_PAGE_SIZE)
+    page = _int_arg("page", 1)
+    if limit < 1 or page < 1:
+        raise APIException("Query params 'limit' and 'page' must be positive", status_code=400)
+
+    def load():
+        rows, facets = search_products(terms, product_serializer.columns, category=category,
+                                       limit=limit, offset=(page - 1) * limit)
+        results = []
+        for row in rows:
+            product = product_serializer.to_dict(row[:-1])
+            product["rank"] = float(row[-1])
+            results.append(product)
+        total = facets.get(category.value, 0) if category else sum(facets.values())
+        return dumps_bytes({"results": results, "facets": facets, "total": total,
+                            "page": page, "limit": limit}), {}
+
+    try:
+        key = "search?" + "&".join(sorted(f"{k}={v}" for k, v in request.args.items(multi=True)))
+        return _catalog_response(key, load)
     except Exception as e:
         raise APIException(str(e), status_code=500)
 
 
 @app.route('/products/<int:id>', methods=['GET'])
+@read_replica(catalog_version)
 def get_product_by_id(id):
-    try:
+    def load():
         # Buscar el producto por su ID (clave primaria)
-        product = db.session.get(Product, id)
+        product = db.session.execute(
+            product_serializer.select().where(Product.id == id)).one_or_none()
 
         # Si no existe, devolver error 404
         if not product:
-            abort(404, description=f"Product with id {id} not found")
+            raise APIException(f"Product with id {id} not found", status_code=404)
 
         # Si existe, devolver el producto serializado
-        return jsonify(product.serialize()), 200
+        return product_serializer.dumps_one(product), {}
 
+    try:
+        return _catalog_response(f"product:{id}", load)
+    except APIException:
+        raise
     except Exception as e:
         raise APIException(str(e), status_code=500)
 
 
+def admin_required(fn):
+    # Como jwt_required() pero ademas el usuario del token debe tener rol ADMIN.
+    # El claim rol descarta al resto sin mirar el usuario; current_identity() viene de la cache
+    @wraps(fn)
+    @jwt_required()
+    def wrapper(*args, **kwargs):
+        if get_jwt().get("rol", RoleEnum.ADMIN.value) != RoleEnum.ADMIN.value:
+            return jsonify({"msg": "Admin access required"}), 403
+        if current_identity()["rol"] != RoleEnum.ADMIN.value:
+            return jsonify({"msg": "Admin access required"}), 403
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/timing/stats', methods=['GET'])
+@admin_required
+def get_timing_stats():
+    # Agregados de este proceso: con varios workers cada uno tiene los suyos
+    return jsonify({"pid": os.getpid(), "endpoints": endpoint_stats.snapshot()}), 200
+
+
+@app.route('/timing/stats', methods=['DELETE'])
+@admin_required
+def reset_timing_stats():
+    endpoint_stats.reset()
+    return jsonify({"msg": "Timing stats reset"}), 200
+
+
+def metrics_token_required(fn):
+    # Si METRICS_TOKEN esta definido, quien raspa las metricas debe enviarlo como Bearer token
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        token = os.getenv("METRICS_TOKEN")
+        if token and request.headers.get("Authorization") != f"Bearer {token}":
+            return jsonify({"msg": "Unauthorized"}), 401
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/metrics', methods=['GET'])
+@metrics_token_required
+def get_metrics():
+    body, content_type = render_metrics()
+    return app.response_class(body, content_type=content_type)
+
+
+@app.route('/cache/stats', methods=['GET'])
+@metrics_token_required
+def get_cache_stats():
+    return jsonify({
+        "catalog_version": catalog_version.current(),
+        "cart_version": cart_version.current(),
+        "products": product_cache.stats(),
+        "carts": cart_cache.stats(),
+        "favorites": favorites_cache.stats(),
+        "identities": identity_cache.stats(),
+    }), 200
+
+
 @app.route("/login", methods=["POST"])
 def login():
     data = request.get_json()
@@ -737,7 +1118,7 @@ def login():
     if user.password != password:
         return jsonify({"msg": "Incorrect password"}), 401
 
-    token = create_access_token(identity=str(user.id))
+    token = create_access_token(identity=str(user.id), additional_claims=identity_claims(user))
     return jsonify({"token": token, "user": user.serialize()}), 200
 
 
@@ -772,64 +1153,138 @@ def register():
 
     except Exception as e:
         # verás el motivo real del 500
-        print("Register error:", e, file=sys.stderr)
-        traceback.print_exc()
+        logger.exception("Register error")
         return jsonify({"msg": f"Internal Error: {str(e)}"}), 500
 
 
 @app.route("/protected", methods=["GET"])
 @jwt_required()
 def protected():
-    user_id = get_jwt_identity()   # ahora es string
-    try:
-        user_id = int(user_id)
-    except (TypeError, ValueError):
-        return jsonify({"msg": "Invalid token identity"}), 422
+    # current_identity() responde 404/403/422 si el usuario no existe, esta inactivo o el token no es valido
+    return jsonify(current_identity()), 200
 
-    user = User.query.get(user_id)
-    if not user:
-        return jsonify({"msg": "User not found"}), 404
 
-    return jsonify(user.serialize()), 200
+def _cart_quantities(order_id):
+    return dict(db.session.execute(
+        db.select(OrderItem.prod_id, OrderItem.quantity)
+        .where(OrderItem.order_id == order_id)).all())
+
+
+def _release_on_failure(order_id):
+    # Callback de start_checkout: libera la reserva si Stripe falla en segundo plano
+    def on_failure(error):
+        with app.app_context():
+            try:
+                release(order_id)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                logger.exception("Could not release the reservation of order %s", order_id)
+    return on_failure
 
 
 @app.route("/create-checkout-session", methods=["POST"])
+@jwt_required()
 def create_checkout_session():
     backend_url = os.getenv("VITE_URL", os.getenv("BACKEND_URL", "http://localhost:3000"))
 
-    data = request.get_json()
-    items = data.get("items", [])
-    subtotal = data.get("subtotal", 0)
+    data = request.get_json(silent=True) or {}
+    try:
+        params = checkout_params(data.get("items", []), backend_url)
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({"error": f"Invalid items: {e}"}), 400
+
+    # Se retiene el stock del carrito antes de llamar a Stripe; el webhook lo confirma o libera
+    # Sin carrito en el servidor no hay nada que reservar: no se abre una sesion sin stock
+    user_id = current_identity()["id"]
+    order_id = _find_cart(user_id)
+    if order_id is None:
+        return jsonify({"error": "The cart is empty"}), 400
+    try:
+        hold_expires_at = reserve(order_id, _cart_quantities(order_id), min_remaining=CHECKOUT_MIN_HOLD_SECONDS)
+        db.session.commit()
+    except OutOfStock as e:
+        db.session.rollback()
+        return jsonify({"error": str(e), "shortages": e.shortages}), 409
+    except Exception as e:
+        db.session.rollback()
+        raise APIException(str(e), status_code=500)
+    params["client_reference_id"] = str(order_id)
+    params["expires_at"] = session_expires_at(hold_expires_at)
 
+    # La clave de idempotencia depende del usuario y del carrito: reintentos -> misma sesion
     try:
-        line_items = []
-        for item in items:
-            line_items.append({
-                "price_data": {
-                    "currency": "eur",
-                    "product_data": {"name": item["name"][:127]},
-                    "unit_amount": int(item["unit_amount"]),
-                },
-                "quantity": int(item["quantity"]),
-            })
-
-        session = stripe.checkout.Session.create(
-            mode="payment",
-            line_items=line_items,
-            payment_method_types=["card"],
-            phone_number_collection={"enabled": True},
-            shipping_address_collection={
-                "allowed_countries": ["ES"]
-            },
-            allow_promotion_codes=False,
-            success_url=f"{backend_url}",
-            cancel_url=f"{backend_url}",
-        )
-        return jsonify({"url": session.url})
+        url = start_checkout(params, idempotency_key(user_id, params), _release_on_failure(order_id))
     except Exception as e:
+        logger.warning("Stripe checkout failed: %s", e)
+        release(order_id)
+        db.session.commit()
+        return jsonify({"error": str(e)}), 502
+
+    if url is None:
+        # Modo thread: Stripe aun no ha respondido, el cliente repite el mismo POST
+        response = jsonify({"status": "pending"})
+        response.headers["Retry-After"] = "1"
+        return response, 202
+    return jsonify({"url": url})
+
+
+def _close_paid_order(order_id):
+    """
+    Marca el pedido como pagado y lo cierra (user_order.is_open): el enlace con el usuario
+    se conserva como historico y su siguiente carrito es un pedido nuevo. UPDATE condicional
+    sobre paid_at, asi un evento repetido (o dos entregas a la vez) solo lo cierra una vez.
+    Devuelve los user_id del pedido, o None si ya estaba pagado. No hace commit.
+    """
+    paid = db.session.execute(
+        db.update(Order).where(Order.id == order_id, Order.paid_at.is_(None))
+        .values(paid_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)).rowcount
+    if not paid:
+        return None
+    return db.session.execute(
+        db.update(user_order).where(user_order.c.order_id == order_id)
+        .values(is_open=False)
+        .returning(user_order.c.user_id)).scalars().all()
+
+
+@app.route("/stripe/webhook", methods=["POST"])
+def stripe_webhook():
+    """
+    checkout.session.completed descuenta del stock lo reservado para el pedido
+    (client_reference_id) y lo cierra; checkout.session.expired lo devuelve al stock disponible.
+    Stripe puede entregar un evento varias veces: los repetidos no hacen nada.
+    """
+    try:
+        event = parse_webhook(request.get_data(), request.headers.get("Stripe-Signature"))
+    except ValueError as e:
         return jsonify({"error": str(e)}), 400
 
+    session = event["data"]["object"]
+    order_id = session.get("client_reference_id")
+    if event["type"] not in ("checkout.session.completed", "checkout.session.expired") or not order_id:
+        return jsonify({"received": True})
 
+    try:
+        order_id = int(order_id)
+        if event["type"] == "checkout.session.completed":
+            user_ids = _close_paid_order(order_id)
+            if user_ids is None:
+                logger.info("Order %s already paid, ignoring event %s", order_id, event.get("id"))
+                return jsonify({"received": True})
+            if not confirm(order_id):
+                logger.error("Order %s paid without reserved stock", order_id)
+            db.session.commit()
+            catalog_version.bump()
+            for user_id in user_ids:
+                cart_version.bump_user(user_id)
+        else:
+            release(order_id)
+            db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        raise APIException(str(e), status_code=500)
+    return jsonify({"received": True})
 
 
 # this only runs if `$ python src/main.py` is executed
@@ -2,6 +2,7 @@ import { Link, useLocation, useNavigate, useSearchParams } from "react-router-do
 import { useEffect, useState } from "react";
 import { useAuth } from "../AuthContext"; // Ruta del contexto
 import { useFavorites } from "../FavoritesContext";
+import { fetchAllProducts } from "../products";
 
 export const Navbar = () => {
   const { currentUser, logout } = useAuth() || {}; // Accedemos al contexto
@@ -37,8 +38,7 @@ export const Navbar = () => {
 
   useEffect(() => {
     products &&
-    fetch("/products")
-      .then((res) => res.json())
+    fetchAllProducts()
       .then(data => {
         console.log("Navbar products: ", data)
         setProducts(data)})
@@ -21,17 +21,26 @@ export const Cart = () => {
         }));
 
         // Enviamos los datos del carrito al backend
-        const response = await fetch("/create-checkout-session", {
+        const checkout = () => fetch("/create-checkout-session", {
             method: "POST",
             headers: {
                 "Content-Type": "application/json",
+                Authorization: `Bearer ${sessionStorage.getItem("token")}`,
             },
             body: JSON.stringify({
                 items: items,
-                subtotal: subtotal 
+                subtotal: subtotal
             }),
         });
 
+        // 202: Stripe aun no ha respondido, se repite el mismo POST (devuelve la misma sesion)
+        let response = await checkout();
+        for (let attempt = 0; response.status === 202 && attempt < 10; attempt++) {
+            const retryAfter = Number(response.headers.get("Retry-After") || 1);
+            await new Promise(resolve => setTimeout(resolve, retryAfter * 1000));
+            response = await checkout();
+        }
+
         const data = await response.json();
 
         if (data.url) {
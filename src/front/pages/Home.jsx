@@ -1,6 +1,7 @@
 import React, { useEffect, useMemo, useState } from "react";
 import { useNavigate } from "react-router-dom";
 import "./Home.css";
+import { fetchAllProducts } from "../products";
 
 // Agrupa en chunks de tamaño `size`: [a,b,c,d,e,f] -> [[a,b,c,d],[e,f,g,h]]
 const chunk = (arr, size) =>
@@ -38,10 +39,7 @@ export const Home = () => {
     const load = async () => {
       try {
         setStatus("loading");
-        const res = await fetch("/products");
-        if (!res.ok) throw new Error(`HTTP ${res.status}`);
-        const data = await res.json();
-        setAllProducts(data);
+        setAllProducts(await fetchAllProducts());
         setStatus("idle");
       } catch (e) {
         console.error("Error cargando productos:", e);
@@ -3,6 +3,7 @@ import { useNavigate, useSearchParams } from "react-router-dom";
 import "./products.css";
 import { useAuth } from "../AuthContext";
 import { useFavorites } from "../FavoritesContext";
+import { fetchAllProducts } from "../products";
 
 // Normaliza rutas de imágenes
 const normalizeImgPath = (path) => {
@@ -101,10 +102,7 @@ export default function Products() {
     const load = async () => {
       try {
         setStatus("loading");
-        const res = await fetch("/products");
-        if (!res.ok) throw new Error(`HTTP ${res.status}`);
-        const data = await res.json();
-        setProducts(Array.isArray(data) ? data : []);
+        setProducts(await fetchAllProducts());
         setStatus("idle");
       } catch (e) {
         console.error("Error cargando productos:", e);
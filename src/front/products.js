@@ -0,0 +1,20 @@
+// GET /products esta paginado: cada respuesta trae como mucho `limit` productos
+// y el cursor de la siguiente pagina en la cabecera X-Next-Cursor.
+const PAGE_SIZE = 100; // PRODUCTS_MAX_PAGE_SIZE del backend
+
+// Recorre todas las paginas y devuelve el catalogo completo (del mas nuevo al mas viejo)
+export const fetchAllProducts = async (params = {}) => {
+  const products = [];
+  let cursor = null;
+  do {
+    const query = new URLSearchParams({ ...params, limit: PAGE_SIZE });
+    if (cursor) query.set("cursor", cursor);
+    const res = await fetch(`/products?${query}`);
+    if (!res.ok) throw new Error(`HTTP ${res.status}`);
+    const page = await res.json();
+    if (!Array.isArray(page)) break;
+    products.push(...page);
+    cursor = res.headers.get("X-Next-Cursor");
+  } while (cursor);
+  return products;
+};
@@ -0,0 +1,23 @@
+"""
+Configuracion de gunicorn. Hay que pasarla con -c (ver Procfile): con --chdir ./src/ gunicorn
+no la encuentra por si solo.
+Prepara el directorio donde cada worker guarda sus metricas de Prometheus,
+para que GET /metrics sume las de todos los workers de la instancia.
+"""
+import os
+import shutil
+import tempfile
+
+metrics_dir = os.environ.setdefault(
+    "PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "triplej-metrics"))
+
+
+def on_starting(server):
+    # Las metricas de un arranque anterior no deben sumarse a las nuevas
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)